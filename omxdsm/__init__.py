@@ -1,2 +1,2 @@
 from omxdsm.html_writer import write_html
-from omxdsm.xdsm_writer import write_xdsm
+from omxdsm.xdsm_writer import write_xdsm, clear_viewer_data_cache, clear_formatting_caches
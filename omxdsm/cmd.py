@@ -89,22 +89,23 @@ def _xdsm_cmd(options, user_args):
         if val is not None:
             kwargs[name] = val
 
+    kwargs.update(filename=options.outfile, model_path=options.model_path,
+                  recurse=options.recurse,
+                  include_external_outputs=not options.no_extern_outputs,
+                  out_format=options.format,
+                  include_solver=options.include_solver, subs=_CHAR_SUBS,
+                  show_browser=not options.no_browser, show_parallel=not options.no_parallel,
+                  add_process_conns=not options.no_process_conns,
+                  output_side=options.output_side,
+                  legend=options.legend,
+                  class_names=options.class_names,
+                  equations=options.equations,
+                  include_indepvarcomps=not options.no_indepvarcomps)
+
     if filename.endswith('.py'):
         # the file is a python script, run as a post_setup hook
         def _xdsm(prob):
-            write_xdsm(prob, filename=options.outfile, model_path=options.model_path,
-                       recurse=options.recurse,
-                       include_external_outputs=not options.no_extern_outputs,
-                       out_format=options.format,
-                       include_solver=options.include_solver, subs=_CHAR_SUBS,
-                       show_browser=not options.no_browser, show_parallel=not options.no_parallel,
-                       add_process_conns=not options.no_process_conns,
-                       output_side=options.output_side,
-                       legend=options.legend,
-                       class_names=options.class_names,
-                       equations=options.equations,
-                       include_indepvarcomps=not options.no_indepvarcomps,
-                       **kwargs)
+            write_xdsm(prob, **kwargs)
             exit()
 
         hooks._register_hook('setup', 'Problem', post=_xdsm)
@@ -112,17 +113,7 @@ def _xdsm_cmd(options, user_args):
         _load_and_exec(options.file[0], user_args)
     else:
         # assume the file is a recording, run standalone
-        write_xdsm(options.file[0], filename=options.outfile, model_path=options.model_path,
-                   recurse=options.recurse,
-                   include_external_outputs=not options.no_extern_outputs,
-                   out_format=options.format,
-                   include_solver=options.include_solver, subs=_CHAR_SUBS,
-                   show_browser=not options.no_browser, show_parallel=not options.no_parallel,
-                   add_process_conns=not options.no_process_conns, output_side=options.output_side,
-                   legend=options.legend,
-                   class_names=options.class_names,
-                   equations=options.equations,
-                   **kwargs)
+        write_xdsm(options.file[0], **kwargs)
 
 
 def _xdsm_setup():
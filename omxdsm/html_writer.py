@@ -2,25 +2,52 @@
 HTML file writing to create standalone XDSMjs output file.
 """
 
+import json
+from functools import lru_cache
+
 import xdsmjs
 
 from openmdao.visualization.html_utils import (
     write_div,
-    head_and_body,
     write_script,
     write_style,
+    write_tags,
 )
 
+try:  # Optional, faster JSON encoder
+    import orjson
+except ImportError:
+    orjson = None
+
+# Translation table to replace the quote marks in the embedded data for the HTML syntax
+_QUOTE_TABLE = str.maketrans({'"': "&quot;", "'": "&quot;"})
+
+# Script, which creates the diagram after the page was loaded
+_INIT_SCRIPT = """
+      document.addEventListener('DOMContentLoaded', function() {
+      xdsmjs.XDSMjs().createXdsm();
+    });
+    """
+# Elements, which are the same in every output file
+_XDSM_INIT = write_script(_INIT_SCRIPT, {"type": "text/javascript"})
+_TOOLBAR_DIV = write_div(attrs={"class": "xdsm-toolbar"})
+# Start and end of the element with the embedded data, which is written between them
+_DATA_DIV_TAGS = tuple(write_div(attrs={"class": "xdsm2", "data-mdo": "\0"}).split("\0"))
+# Buffer size of the output file in bytes. Large enough to take the small blocks between the
+# script bundle and the data without a system call for each of them.
+_BUFFER_SIZE = 1024 * 1024
+
 
 def write_html(
-    outfile, source_data=None, data_file=None, embeddable=False, char_set="utf-8"
+    outfile, source_data=None, data_file=None, embeddable=False, char_set="utf-8",
+    source_is_escaped=False,
 ):
     """
     Write XDSMjs HTML output file, with style and script files embedded.
 
     The source data can be the name of a JSON file or a dictionary.
     If a JSON file name is provided, the file will be referenced in the HTML.
-    If the input is a dictionary, it will be embedded.
+    If the input is a dictionary, it will be embedded as JSON.
 
     If both data file and source data are given, data file is
 
@@ -37,25 +64,27 @@ def write_html(
         and <head> tags. If False, gives a single, standalone HTML file for viewing.
     char_set : str, optional
         HTML character set.
+    source_is_escaped : bool, optional
+        If True, a string source data is embedded as it is. Use it, if the quote marks were
+        already replaced with "&quot;", e.g. when the same data is written to several files.
+        Defaults to False.
     """
-    code = xdsmjs.bundlejs()
-    xdsm_bundle = write_script(code, {"type": "text/javascript"})
-
-    init = """
-      document.addEventListener('DOMContentLoaded', function() {
-      xdsmjs.XDSMjs().createXdsm();
-    });
-    """
-    xdsm_init = write_script(init, {"type": "text/javascript"})
+    xdsm_bundle, styles_elem = _xdsmjs_elements()
 
-    xdsm_attrs = {"class": "xdsm2"}
     # grab the data
     if data_file is not None:
         # Add name of the data file
-        xdsm_attrs["data-mdo-file"] = data_file
+        xdsm_attrs = {"class": "xdsm2", "data-mdo-file": data_file}
+        xdsm_div = (write_div(attrs=xdsm_attrs),)
     elif source_data is not None:
-        if isinstance(source_data, (dict, str)):
-            data_str = str(source_data)  # dictionary converted to string
+        if isinstance(source_data, dict):
+            # Serialized as JSON, so only the double quotes have to be replaced for the HTML syntax
+            data_str = _dumps_json(source_data).replace('"', "&quot;")
+        elif isinstance(source_data, str):
+            if source_is_escaped:
+                data_str = source_data
+            else:  # Replace quote marks for the HTML syntax
+                data_str = source_data.translate(_QUOTE_TABLE)
         else:
             msg = (
                 "Invalid data type for source data: {} \n"
@@ -63,37 +92,72 @@ def write_html(
             )
             raise ValueError(msg.format(type(source_data)))
 
-        # Replace quote marks for the HTML syntax
-        for i in ('u"', "u'", '"', "'"):  # quote marks and unicode prefixes
-            data_str = data_str.replace(i, r"&quot;")
-        xdsm_attrs["data-mdo"] = data_str
+        # The data is written between the tags, without formatting it into the element
+        xdsm_div = _DATA_DIV_TAGS[0], data_str, _DATA_DIV_TAGS[1]
     else:  # both source data and data file name are None
         msg = 'Specify either "source_data" or "data_file".'
         raise ValueError(msg.format(type(source_data)))
 
-    # grab the style
+    # Embed style, scripts and data to HTML
+    # The blocks are written one by one, so the (possibly large) document is not joined in memory
+    with open(outfile, "w", encoding=char_set, buffering=_BUFFER_SIZE) as f_out:
+        if embeddable:
+            _write_blocks(f_out, styles_elem, xdsm_bundle, _TOOLBAR_DIV)
+            f_out.write("\n\n")
+            f_out.writelines(xdsm_div)
+        else:
+            meta = '<meta charset="{}">'.format(char_set)
+            html_open, html_close = _split_tags("html", attrs={"class": "js", "lang": ""})
+            head_open, head_close = _split_tags("head")
+            body_open, body_close = _split_tags("body")
+
+            f_out.write("<!doctype html>\n")
+            f_out.write(html_open)
+            f_out.write(head_open)
+            _write_blocks(f_out, meta, styles_elem, xdsm_bundle, _XDSM_INIT)
+            f_out.write(head_close)
+            f_out.write("\n\n")
+            f_out.write(body_open)
+            f_out.write(_TOOLBAR_DIV)
+            f_out.write("\n\n")
+            f_out.writelines(xdsm_div)
+            f_out.write(body_close)
+            f_out.write(html_close)
+
+
+def _dumps_json(data):
+    # Serializes the XDSMjs data as compact JSON, with orjson if it is installed. The json module is
+    # set up to give the same output: no whitespace and non-ASCII characters are not escaped.
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+@lru_cache(maxsize=1)
+def _xdsmjs_elements():
+    # The script element with the XDSMjs bundle and the style element with its CSS.
+    # These are the same for every output file, so they are read and formatted only once.
+    xdsm_bundle = write_script(xdsmjs.bundlejs(), {"type": "text/javascript"})
     styles_elem = write_style(xdsmjs.css())
+    return xdsm_bundle, styles_elem
 
-    # put all style and JS into index
-    toolbar_div = write_div(attrs={"class": "xdsm-toolbar"})
-    xdsm_div = write_div(attrs=xdsm_attrs)
-    body = "\n\n".join([toolbar_div, xdsm_div])
 
-    if embeddable:
-        index = "\n\n".join([styles_elem, xdsm_bundle, body])
-    else:
-        meta = '<meta charset="{}">'.format(char_set)
-        head = "\n\n".join([meta, styles_elem, xdsm_bundle, xdsm_init])
-        index = head_and_body(head, body, attrs={"class": "js", "lang": ""})
+def _split_tags(tag, attrs=None):
+    # Returns the opening and closing tags of an element in the same format as head_and_body
+    # writes them, so the content can be written between them.
+    open_tag, close_tag = write_tags(tag=tag, content="\0", attrs=attrs, new_lines=True).split("\0")
+    return open_tag, close_tag
 
-    # Embed style, scripts and data to HTML
-    with open(outfile, "w") as f_out:
-        f_out.write(index)
 
+def _write_blocks(f_out, *blocks):
+    # Writes the blocks to the file separated with empty lines
+    for i, block in enumerate(blocks):
+        if i:
+            f_out.write("\n\n")
+        f_out.write(block)
 
-if __name__ == "__main__":
-    import json
 
+if __name__ == "__main__":
     # with JSON file name as input
     write_html(outfile="xdsmjs/xdsm_diagram.html", source_data="examples/idf.json")
 
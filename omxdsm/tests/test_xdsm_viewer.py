@@ -1,10 +1,16 @@
+import copy
 import os
+import re
+import shutil
+import tempfile
 import unittest
-from distutils.version import LooseVersion
+from argparse import ArgumentParser
+from collections import Counter
+from functools import lru_cache
+from unittest import mock
 
 import numpy as np
 import openmdao.api as om
-from numpy.distutils.exec_command import find_executable
 from openmdao.test_suite.components.sellar import SellarNoDerivatives, SellarDis1, SellarDis2
 from openmdao.test_suite.components.sellar_feature import SellarMDA
 from openmdao.test_suite.scripts.circuit import Circuit
@@ -14,7 +20,10 @@ from openmdao.utils.testing_utils import use_tempdirs
 from pyxdsm.XDSM import XDSM
 from openmdao import __version__ as om_version
 
-from omxdsm import write_xdsm, write_html
+from omxdsm import write_xdsm, write_html, clear_viewer_data_cache, clear_formatting_caches
+from omxdsm import html_writer, xdsm_writer
+from omxdsm.cmd import _xdsm_cmd, _xdsm_setup_parser
+from omxdsm.xdsm_writer import XDSMjsWriter, _load_recorded_viewer_data, _load_viewer_data
 
 # Set DEBUG to True if you want to view the generated HTML and PDF output files.
 DEBUG = False
@@ -23,70 +32,398 @@ QUIET = not DEBUG
 # If not in debug mode, tests will generate only the TeX files and not the PDFs, except for the
 # PDF creation test, which is independent of this setting.
 PYXDSM_OUT = 'pdf' if DEBUG else 'tex'
+# Version of OpenMDAO as a tuple of integers, e.g. (3, 2, 1)
+OM_VERSION_INFO = tuple(int(n) for n in re.findall(r'\d+', om_version)[:3])
 # Show in browser
 SHOW = False
+# Path of the pdflatex executable, None if it is not installed
+PDFLATEX = shutil.which('pdflatex')
+
+
+def _tempdirs_decorator(cls):
+    # Runs the tests in temporary directories, except in debug mode, where the output files are
+    # written to the working directory and kept.
+    return cls if DEBUG else use_tempdirs(cls)
+
+
+# RAM-backed directory (Linux), where the test directories are created, if TMPDIR is not set
+SHM_DIR = '/dev/shm'
+_default_tempdir = None
+
+
+def setUpModule():
+    # The tests write many small files and a recording, create their directories in memory
+    global _default_tempdir
+    _default_tempdir = tempfile.tempdir
+    if 'TMPDIR' not in os.environ and os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+        tempfile.tempdir = SHM_DIR
+
+
+def tearDownModule():
+    tempfile.tempdir = _default_tempdir
+
+
+def _filter_tikz_lines(lns):
+    # Empty lines are excluded.
+    # Leading and trailing whitespaces are removed
+    # Comments are removed.
+    return [ln.strip() for ln in lns if ln.strip() and not ln.strip().startswith('%')]
+
+
+# Sample TiKZ output of the Sellar MDA for test_pyxdsm_tikz_content.
+# The sample text should be replaced if changes in the formatting or in the test problem are made.
+SAMPLE_TIKZ_TXT = r"""
+
+%%% Preamble Requirements %%%
+% \usepackage{geometry}
+% \usepackage{amsfonts}
+% \usepackage{amsmath}
+% \usepackage{amssymb}
+% \usepackage{tikz}
+
+% Optional packages such as sfmath set through python interface
+% \usepackage{sfmath}
+
+% \usetikzlibrary{arrows,chains,positioning,scopes,shapes.geometric,shapes.misc,shadows}
+
+%%% End Preamble Requirements %%%
+
+\input{"path/to/diagram_styles"}
+\begin{tikzpicture}
+
+\matrix[MatrixSetup]{
+%Row 0
+\node [Optimization] (Driver) {$\text{\text{0, 10 $ \rightarrow $ 1: Driver}}$};&
+&
+&
+&
+&
+&
+&
+\\
+%Row 1
+&
+\node [Function] (indeps) {$\begin{array}{c}\text{1: indeps} \\ \text{\textit{IndepVarComp}}\end{array}$};&
+&
+\node [DataInter] (indeps-cycle@d1) {$\begin{array}{c}x, z\end{array}$};&
+\node [DataInter] (indeps-cycle@d2) {$\begin{array}{c}z\end{array}$};&
+\node [DataInter] (indeps-obj@cmp) {$\begin{array}{c}x, z\end{array}$};&
+&
+\\
+%Row 2
+&
+&
+\node [MDA] (cycle@solver) {$\text{\text{2, 5 $ \rightarrow $ 3: NL: NLBGS}}$};&
+\node [DataInter] (cycle@solver-cycle@d1) {$\begin{array}{c}y2^{t}\end{array}$};&
+\node [DataInter] (cycle@solver-cycle@d2) {$\begin{array}{c}y1^{t}\end{array}$};&
+&
+&
+\\
+%Row 3
+&
+&
+\node [DataInter] (cycle@d1-cycle@solver) {$\begin{array}{c}y1\end{array}$};&
+\node [Function] (cycle@d1) {$\begin{array}{c}\text{3: d1} \\ \text{\textit{SellarDis1}}\end{array}$};&
+\node [DataInter] (cycle@d1-cycle@d2) {$\begin{array}{c}y1\end{array}$};&
+\node [DataInter] (cycle@d1-obj@cmp) {$\begin{array}{c}y1\end{array}$};&
+\node [DataInter] (cycle@d1-con@cmp1) {$\begin{array}{c}y1\end{array}$};&
+\\
+%Row 4
+&
+&
+\node [DataInter] (cycle@d2-cycle@solver) {$\begin{array}{c}y2\end{array}$};&
+\node [DataInter] (cycle@d2-cycle@d1) {$\begin{array}{c}y2\end{array}$};&
+\node [Function] (cycle@d2) {$\begin{array}{c}\text{4: d2} \\ \text{\textit{SellarDis2}}\end{array}$};&
+\node [DataInter] (cycle@d2-obj@cmp) {$\begin{array}{c}y2\end{array}$};&
+&
+\node [DataInter] (cycle@d2-con@cmp2) {$\begin{array}{c}y2\end{array}$};\\
+%Row 5
+&
+&
+&
+&
+&
+\node [Function] (obj@cmp) {$\begin{array}{c}\text{6: obj\_cmp} \\ \text{\textit{ExecComp}}\end{array}$};&
+&
+\\
+%Row 6
+&
+&
+&
+&
+&
+&
+\node [Function] (con@cmp1) {$\begin{array}{c}\text{7: con\_cmp1} \\ \text{\textit{ExecComp}}\end{array}$};&
+\\
+%Row 7
+&
+&
+&
+&
+&
+&
+&
+\node [Function] (con@cmp2) {$\begin{array}{c}\text{8: con\_cmp2} \\ \text{\textit{ExecComp}}\end{array}$};\\
+};
+
+% XDSM process chains
+{ [start chain=process]
+ \begin{pgfonlayer}{process} 
+\chainin (Driver);
+\chainin (indeps) [join=by ProcessHV];
+\chainin (cycle@solver) [join=by ProcessHV];
+\chainin (obj@cmp) [join=by ProcessHV];
+\chainin (con@cmp1) [join=by ProcessHV];
+\chainin (con@cmp2) [join=by ProcessHV];
+\chainin (Driver) [join=by ProcessHV];
+\end{pgfonlayer}
+}{ [start chain=process]
+ \begin{pgfonlayer}{process} 
+\chainin (cycle@solver);
+\chainin (cycle@d1) [join=by ProcessHV];
+\chainin (cycle@d2) [join=by ProcessHV];
+\chainin (cycle@solver) [join=by ProcessHV];
+\end{pgfonlayer}
+}
+
+\begin{pgfonlayer}{data}
+\path
+% Horizontal edges
+(cycle@solver) edge [DataLine] (cycle@solver-cycle@d2)
+(cycle@d1) edge [DataLine] (cycle@d1-cycle@solver)
+(cycle@solver) edge [DataLine] (cycle@solver-cycle@d1)
+(cycle@d2) edge [DataLine] (cycle@d2-cycle@solver)
+(cycle@d1) edge [DataLine] (cycle@d1-obj@cmp)
+(cycle@d1) edge [DataLine] (cycle@d1-con@cmp1)
+(cycle@d1) edge [DataLine] (cycle@d1-cycle@d2)
+(cycle@d2) edge [DataLine] (cycle@d2-obj@cmp)
+(cycle@d2) edge [DataLine] (cycle@d2-con@cmp2)
+(cycle@d2) edge [DataLine] (cycle@d2-cycle@d1)
+(indeps) edge [DataLine] (indeps-cycle@d1)
+(indeps) edge [DataLine] (indeps-obj@cmp)
+(indeps) edge [DataLine] (indeps-cycle@d2)
+% Vertical edges
+(cycle@solver-cycle@d2) edge [DataLine] (cycle@d2)
+(cycle@d1-cycle@solver) edge [DataLine] (cycle@solver)
+(cycle@solver-cycle@d1) edge [DataLine] (cycle@d1)
+(cycle@d2-cycle@solver) edge [DataLine] (cycle@solver)
+(cycle@d1-obj@cmp) edge [DataLine] (obj@cmp)
+(cycle@d1-con@cmp1) edge [DataLine] (con@cmp1)
+(cycle@d1-cycle@d2) edge [DataLine] (cycle@d2)
+(cycle@d2-obj@cmp) edge [DataLine] (obj@cmp)
+(cycle@d2-con@cmp2) edge [DataLine] (con@cmp2)
+(cycle@d2-cycle@d1) edge [DataLine] (cycle@d1)
+(indeps-cycle@d1) edge [DataLine] (cycle@d1)
+(indeps-obj@cmp) edge [DataLine] (obj@cmp)
+(indeps-cycle@d2) edge [DataLine] (cycle@d2);
+\end{pgfonlayer}
+
+\end{tikzpicture}"""
+# Filtered lines of the sample, computed once
+SAMPLE_TIKZ_LINES = tuple(_filter_tikz_lines(SAMPLE_TIKZ_TXT.split('\n')))
+
+
+# Bounds of the "z" design variable and the "con1" constraint value in the Sellar problems.
+# OpenMDAO copies these, so the same arrays are used in every test. They are read-only, so a
+# test cannot change them for the others.
+SELLAR_Z_LOWER = np.array([-10.0, 0.0])
+SELLAR_Z_UPPER = np.array([10.0, 10.0])
+SELLAR_Z_INDICES = np.arange(2, dtype=int)
+SELLAR_CON1_EQUALS = np.zeros(1)
+for _arr in (SELLAR_Z_LOWER, SELLAR_Z_UPPER, SELLAR_Z_INDICES, SELLAR_CON1_EQUALS):
+    _arr.setflags(write=False)
+del _arr
+
+
+def _file_names():
+    # Names of the files in the working directory, read with a single directory scan
+    with os.scandir() as entries:
+        return {entry.name for entry in entries if entry.is_file()}
+
+
+def _add_sellar_optimization(model, x_design_var=True):
+    # Adds the design variables, objective and constraints of the Sellar problem to the model
+    model.add_design_var('z', lower=SELLAR_Z_LOWER, upper=SELLAR_Z_UPPER, indices=SELLAR_Z_INDICES)
+    if x_design_var:
+        model.add_design_var('x', lower=0.0, upper=10.0)
+    model.add_objective('obj')
+    model.add_constraint('con1', equals=SELLAR_CON1_EQUALS)
+    model.add_constraint('con2', upper=0.0)
+
+
+@lru_cache(maxsize=1)
+def _sellar_problem():
+    # Sellar optimization problem. It is set up once and shared by the tests, which do not modify it.
+    p = om.Problem()
+    p.model = model = SellarNoDerivatives()
+    _add_sellar_optimization(model)
+
+    p.setup()
+    return p
+
+
+@lru_cache(maxsize=1)
+def _sellar_mdf_problem():
+    # Sellar MDF problem with an optimizer. It is set up once and shared by the tests, which do not
+    # modify it.
+    p = om.Problem(model=SellarMDA())
+    model = p.model
+    p.driver = om.ScipyOptimizeDriver()
+
+    _add_sellar_optimization(model)
+
+    p.setup()
+    return p
+
+
+@lru_cache(maxsize=1)
+def _meta_model_problem():
+    # Problem with a structured meta model. It is set up once and shared by the tests, which do
+    # not modify it.
+    from openmdao.components.tests.test_meta_model_structured_comp import SampleMap
+
+    model = om.Group()
+    ivc = om.IndepVarComp()
+
+    mapdata = SampleMap()
+
+    params = mapdata.param_data
+    x, y, z = params
+    outs = mapdata.output_data
+    z = outs[0]
+    ivc.add_output('x', x['default'], units=x['units'])
+    ivc.add_output('y', y['default'], units=y['units'])
+    ivc.add_output('z', z['default'], units=z['units'])
+
+    model.add_subsystem('des_vars', ivc, promotes=["*"])
+
+    comp = om.MetaModelStructuredComp(method='slinear', extrapolate=True)
+
+    for param in params:
+        comp.add_input(param['name'], param['default'], param['values'])
+
+    for out in outs:
+        comp.add_output(out['name'], out['default'], out['values'])
+
+    model.add_subsystem('comp', comp, promotes=["*"])
+    p = om.Problem(model)
+    p.setup()
+    return p
+
+
+class Square(om.ExplicitComponent):
+
+    def setup(self):
+        self.add_input('x', np.array([1.5, 1.5]))
+        self.add_output('f', 0.0)
+        self.declare_partials('f', 'x', method='fd', form='central', step=1e-4)
+
+    def compute(self, inputs, outputs, discrete_inputs=None, discrete_outputs=None):
+        x = inputs['x']
+        outputs['f'] = x @ x
+
+
+class TimeComp(om.ExplicitComponent):
+
+    def setup(self):
+        self.add_input('t_initial', val=0.)
+        self.add_input('t_duration', val=1.)
+        self.add_output('time', shape=(2,))
+
+    def compute(self, inputs, outputs):
+        t_initial = inputs['t_initial']
+        t_duration = inputs['t_duration']
+
+        outputs['time'][0] = t_initial
+        outputs['time'][1] = t_initial + t_duration
+
+
+class Phase(om.Group):
+
+    def setup(self):
+        super(Phase, self).setup()
 
-if DEBUG:
-    use_tempdirs = lambda cls: cls
+        indep = om.IndepVarComp()
+        for var in ['t_initial', 't_duration']:
+            indep.add_output(var, val=1.0)
 
+        self.add_subsystem('time_extents', indep, promotes_outputs=['*'])
 
-@use_tempdirs
+        time_comp = TimeComp()
+        self.add_subsystem('time', time_comp)
+
+        self.connect('t_initial', 'time.t_initial')
+        self.connect('t_duration', 'time.t_duration')
+
+        self.set_order(['time_extents', 'time'])
+
+
+class ParallelSellarMDA(om.Group):
+    """
+    Group containing the Sellar MDA with the disciplines in a parallel group.
+    """
+
+    def setup(self):
+        indeps = self.add_subsystem('indeps', om.IndepVarComp(), promotes=['*'])
+        indeps.add_output('x', 1.0)
+        indeps.add_output('z', np.array([5.0, 2.0]))
+        cycle = self.add_subsystem('cycle', om.ParallelGroup(), promotes=['*'])
+        cycle.add_subsystem('d1', SellarDis1(), promotes_inputs=['x', 'z', 'y2'], promotes_outputs=['y1'])
+        cycle.add_subsystem('d2', SellarDis2(), promotes_inputs=['z', 'y1'], promotes_outputs=['y2'])
+
+        # Nonlinear Block Gauss Seidel is a gradient free solver
+        cycle.nonlinear_solver = om.NonlinearBlockGS()
+
+        self.add_subsystem('obj_cmp', om.ExecComp('obj = x**2 + z[1] + y1 + exp(-y2)',
+                                                  z=np.array([0.0, 0.0]), x=0.0),
+                           promotes=['x', 'z', 'y1', 'y2', 'obj'])
+
+        self.add_subsystem('con_cmp1', om.ExecComp('con1 = 3.16 - y1'), promotes=['con1', 'y1'])
+        self.add_subsystem('con_cmp2', om.ExecComp('con2 = y2 - 24.0'), promotes=['con2', 'y2'])
+
+
+@_tempdirs_decorator
 class TestPyXDSMViewer(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # Sellar problems shared by the tests, which do not modify the model
+        cls.sellar_problem = _sellar_problem()
+        cls.sellar_mdf_problem = _sellar_mdf_problem()
+
     def test_pyxdsm_output_sides(self):
         """Makes XDSM for the Sellar problem"""
-        p = om.Problem()
-        p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_problem
 
         # Write output (outputs on the left)
         filename = 'xdsm_outputs_on_the_left'
         write_xdsm(p, filename=filename, out_format=PYXDSM_OUT, show_browser=SHOW, quiet=QUIET, output_side='left')
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '.' + PYXDSM_OUT))
-
         filename = 'xdsm_outputs_on_the_right'
         # Write output (all outputs on the right)
         write_xdsm(p, filename=filename, out_format=PYXDSM_OUT, show_browser=SHOW, quiet=QUIET, output_side='right')
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '.' + PYXDSM_OUT))
-
         filename = 'xdsm_outputs_side_mixed'
         # Write output (outputs mixed)
         write_xdsm(p, filename=filename, out_format=PYXDSM_OUT, show_browser=SHOW, quiet=QUIET,
                    output_side={'optimization': 'left', 'default': 'right'})
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '.' + PYXDSM_OUT))
+        # Check if the files were created
+        file_names = _file_names()
+        for filename in ('xdsm_outputs_on_the_left', 'xdsm_outputs_on_the_right', 'xdsm_outputs_side_mixed'):
+            self.assertIn(filename + '.' + PYXDSM_OUT, file_names)
 
     def test_pyxdsm_case_reading(self):
         """
         Writes a recorder file, and the XDSM writer makes the diagram based on the SQL file
         and not the Problem instance.
         """
-        import openmdao.api as om
-
         filename = 'xdsm_from_sql'
         case_recording_filename = filename + '.sql'
 
         p = om.Problem()
         p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]),
-                             upper=np.array([10.0, 10.0]), indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
+        _add_sellar_optimization(model)
 
         recorder = om.SqliteRecorder(case_recording_filename)
         p.driver.add_recorder(recorder)
@@ -95,30 +432,84 @@ class TestPyXDSMViewer(unittest.TestCase):
         p.final_setup()
 
         # Write output
+        clear_viewer_data_cache()
         write_xdsm(case_recording_filename, filename=filename, out_format='tex', show_browser=False, quiet=QUIET)
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(case_recording_filename))
+        # Check that there are no errors when running the command with a recording.
+        # The command is called in this process, test_command checks the "openmdao xdsm" entry.
+        parser = ArgumentParser()
+        _xdsm_setup_parser(parser)
+        options = parser.parse_args(['--no_browser', case_recording_filename])
+        _xdsm_cmd(options, [])
+        # The unchanged recording was read only once
+        self.assertEqual(_load_recorded_viewer_data.cache_info().hits, 1)
+
+        # Check if the files were created
+        file_names = _file_names()
+        self.assertIn(case_recording_filename, file_names)
+        self.assertIn(filename + '.tex', file_names)
+        self.assertIn(options.outfile + '.html', file_names)
+
+    def test_pyxdsm_case_reading_identical_relative_names(self):
+        # The model data of the recording is cached, writing the diagram again must not depend
+        # on the renamed components of the first diagram.
+        filename = 'xdsm_from_sql_identical_rel_names'
+        case_recording_filename = filename + '.sql'
+
+        p = om.Problem()
+        for name in ('g1', 'g2'):
+            group = p.model.add_subsystem(name, om.Group())
+            group.add_subsystem('comp', om.ExecComp('y=2.0*x'))
+            group.add_subsystem('comp2', om.ExecComp('y=3.0*x'))
+            group.connect('comp.y', 'comp2.x')
+            group.nonlinear_solver = om.NonlinearBlockGS()
+
+        recorder = om.SqliteRecorder(case_recording_filename)
+        p.driver.add_recorder(recorder)
+
+        p.setup()
+        p.final_setup()
+
+        clear_viewer_data_cache()
+        tikz_contents = []
+        for _ in range(2):
+            write_xdsm(case_recording_filename, filename=filename, out_format='tex', show_browser=False,
+                       quiet=QUIET, include_solver=True)
+            with open(filename + '.tikz') as f:
+                tikz_contents.append(f.read())
+        self.assertEqual(_load_recorded_viewer_data.cache_info().hits, 1)
+        self.assertEqual(tikz_contents[0], tikz_contents[1])
+
+        # Other options with the same cached data
+        write_xdsm(case_recording_filename, filename=filename, out_format='tex', show_browser=False,
+                   quiet=QUIET, include_indepvarcomps=False)
         self.assertTrue(os.path.isfile(filename + '.tex'))
 
-        # Check that there are no errors when running from the command line with a recording.
-        check_call('openmdao xdsm --no_browser {}'.format(case_recording_filename))
+        # Changing the loaded data does not change the cached data
+        viewer_data = _load_viewer_data(case_recording_filename)
+        expected = copy.deepcopy(viewer_data)
+        viewer_data['tree']['children'][0]['name'] = 'changed'
+        viewer_data['tree']['children'].pop()
+        viewer_data['connections_list'].clear()
+        self.assertEqual(_load_viewer_data(case_recording_filename), expected)
+
+    def test_clear_formatting_caches(self):
+        filename = 'pyxdsm_clear_caches'
+        write_xdsm(self.sellar_problem, filename=filename, out_format='tex', quiet=QUIET, show_browser=SHOW)
+        caches = (xdsm_writer._textify, xdsm_writer._convert_abs_name, xdsm_writer._translate_illegal_chars,
+                  xdsm_writer._compile_substitutes)
+        for cache in caches:
+            self.assertGreater(cache.cache_info().currsize, 0)
+
+        clear_formatting_caches()
+        for cache in caches:
+            self.assertEqual(cache.cache_info().currsize, 0)
 
     def test_pyxdsm_sellar_no_recurse(self):
         """Makes XDSM for the Sellar problem, with no recursion."""
 
         filename = 'xdsm1'
-        p = om.Problem()
-        p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_problem
 
         # Write output
         write_xdsm(p, filename=filename, out_format=PYXDSM_OUT, show_browser=SHOW, recurse=False, quiet=QUIET)
@@ -132,17 +523,6 @@ class TestPyXDSMViewer(unittest.TestCase):
         objective.
         """
 
-        class Square(om.ExplicitComponent):
-
-            def setup(self):
-                self.add_input('x', np.array([1.5, 1.5]))
-                self.add_output('f', 0.0)
-                self.declare_partials('f', 'x', method='fd', form='central', step=1e-4)
-
-            def compute(self, inputs, outputs, discrete_inputs=None, discrete_outputs=None):
-                x = inputs['x']
-                outputs['f'] = sum(x ** 2)
-
         x0 = np.array([1.2, 1.5])
         filename = 'xdsm2'
 
@@ -158,189 +538,30 @@ class TestPyXDSMViewer(unittest.TestCase):
         p.model.add_constraint('c', lower=1.0)
 
         p.setup()
-        p.final_setup()
 
         # requesting 'pdf', but if 'pdflatex' is not found we will only get 'tex'
-        pdflatex = find_executable('pdflatex')
-
         # Write output
         write_xdsm(p, filename=filename, out_format='pdf', show_browser=SHOW, quiet=QUIET)
 
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.tex'))
         # Check if PDF was created (only if pdflatex is installed)
-        self.assertTrue(not pdflatex or os.path.isfile(filename + '.pdf'))
+        self.assertTrue(not PDFLATEX or os.path.isfile(filename + '.pdf'))
 
     @unittest.SkipTest
     def test_pyxdsm_tikz_content(self):
         # Check if TiKZ file was created.
-        # Compare the content of the sample below and the newly created TiKZ file.
+        # Compare the content of the sample (SAMPLE_TIKZ_TXT) and the newly created TiKZ file.
         # The texts are cleaned up before comparison from whitespaces, line ends and comments
         # Despite this different versions of pyxdsm *might* produce different outputs. If the test fails for you,
         # it might be that the program still produces the correct output.
         # The ordering of some lines might be different at different runs, but the test should work regardless
         # of these changes.
-        # The sample text should be replaced if changes in the formatting or in the test problem are made.
-
-        sample_tikz_txt = r"""
-
-            %%% Preamble Requirements %%%
-            % \usepackage{geometry}
-            % \usepackage{amsfonts}
-            % \usepackage{amsmath}
-            % \usepackage{amssymb}
-            % \usepackage{tikz}
-
-            % Optional packages such as sfmath set through python interface
-            % \usepackage{sfmath}
-
-            % \usetikzlibrary{arrows,chains,positioning,scopes,shapes.geometric,shapes.misc,shadows}
-
-            %%% End Preamble Requirements %%%
-
-            \input{"path/to/diagram_styles"}
-            \begin{tikzpicture}
-
-            \matrix[MatrixSetup]{
-            %Row 0
-            \node [Optimization] (Driver) {$\text{\text{0, 10 $ \rightarrow $ 1: Driver}}$};&
-            &
-            &
-            &
-            &
-            &
-            &
-            \\
-            %Row 1
-            &
-            \node [Function] (indeps) {$\begin{array}{c}\text{1: indeps} \\ \text{\textit{IndepVarComp}}\end{array}$};&
-            &
-            \node [DataInter] (indeps-cycle@d1) {$\begin{array}{c}x, z\end{array}$};&
-            \node [DataInter] (indeps-cycle@d2) {$\begin{array}{c}z\end{array}$};&
-            \node [DataInter] (indeps-obj@cmp) {$\begin{array}{c}x, z\end{array}$};&
-            &
-            \\
-            %Row 2
-            &
-            &
-            \node [MDA] (cycle@solver) {$\text{\text{2, 5 $ \rightarrow $ 3: NL: NLBGS}}$};&
-            \node [DataInter] (cycle@solver-cycle@d1) {$\begin{array}{c}y2^{t}\end{array}$};&
-            \node [DataInter] (cycle@solver-cycle@d2) {$\begin{array}{c}y1^{t}\end{array}$};&
-            &
-            &
-            \\
-            %Row 3
-            &
-            &
-            \node [DataInter] (cycle@d1-cycle@solver) {$\begin{array}{c}y1\end{array}$};&
-            \node [Function] (cycle@d1) {$\begin{array}{c}\text{3: d1} \\ \text{\textit{SellarDis1}}\end{array}$};&
-            \node [DataInter] (cycle@d1-cycle@d2) {$\begin{array}{c}y1\end{array}$};&
-            \node [DataInter] (cycle@d1-obj@cmp) {$\begin{array}{c}y1\end{array}$};&
-            \node [DataInter] (cycle@d1-con@cmp1) {$\begin{array}{c}y1\end{array}$};&
-            \\
-            %Row 4
-            &
-            &
-            \node [DataInter] (cycle@d2-cycle@solver) {$\begin{array}{c}y2\end{array}$};&
-            \node [DataInter] (cycle@d2-cycle@d1) {$\begin{array}{c}y2\end{array}$};&
-            \node [Function] (cycle@d2) {$\begin{array}{c}\text{4: d2} \\ \text{\textit{SellarDis2}}\end{array}$};&
-            \node [DataInter] (cycle@d2-obj@cmp) {$\begin{array}{c}y2\end{array}$};&
-            &
-            \node [DataInter] (cycle@d2-con@cmp2) {$\begin{array}{c}y2\end{array}$};\\
-            %Row 5
-            &
-            &
-            &
-            &
-            &
-            \node [Function] (obj@cmp) {$\begin{array}{c}\text{6: obj\_cmp} \\ \text{\textit{ExecComp}}\end{array}$};&
-            &
-            \\
-            %Row 6
-            &
-            &
-            &
-            &
-            &
-            &
-            \node [Function] (con@cmp1) {$\begin{array}{c}\text{7: con\_cmp1} \\ \text{\textit{ExecComp}}\end{array}$};&
-            \\
-            %Row 7
-            &
-            &
-            &
-            &
-            &
-            &
-            &
-            \node [Function] (con@cmp2) {$\begin{array}{c}\text{8: con\_cmp2} \\ \text{\textit{ExecComp}}\end{array}$};\\
-            };
-
-            % XDSM process chains
-            { [start chain=process]
-             \begin{pgfonlayer}{process} 
-            \chainin (Driver);
-            \chainin (indeps) [join=by ProcessHV];
-            \chainin (cycle@solver) [join=by ProcessHV];
-            \chainin (obj@cmp) [join=by ProcessHV];
-            \chainin (con@cmp1) [join=by ProcessHV];
-            \chainin (con@cmp2) [join=by ProcessHV];
-            \chainin (Driver) [join=by ProcessHV];
-            \end{pgfonlayer}
-            }{ [start chain=process]
-             \begin{pgfonlayer}{process} 
-            \chainin (cycle@solver);
-            \chainin (cycle@d1) [join=by ProcessHV];
-            \chainin (cycle@d2) [join=by ProcessHV];
-            \chainin (cycle@solver) [join=by ProcessHV];
-            \end{pgfonlayer}
-            }
-
-            \begin{pgfonlayer}{data}
-            \path
-            % Horizontal edges
-            (cycle@solver) edge [DataLine] (cycle@solver-cycle@d2)
-            (cycle@d1) edge [DataLine] (cycle@d1-cycle@solver)
-            (cycle@solver) edge [DataLine] (cycle@solver-cycle@d1)
-            (cycle@d2) edge [DataLine] (cycle@d2-cycle@solver)
-            (cycle@d1) edge [DataLine] (cycle@d1-obj@cmp)
-            (cycle@d1) edge [DataLine] (cycle@d1-con@cmp1)
-            (cycle@d1) edge [DataLine] (cycle@d1-cycle@d2)
-            (cycle@d2) edge [DataLine] (cycle@d2-obj@cmp)
-            (cycle@d2) edge [DataLine] (cycle@d2-con@cmp2)
-            (cycle@d2) edge [DataLine] (cycle@d2-cycle@d1)
-            (indeps) edge [DataLine] (indeps-cycle@d1)
-            (indeps) edge [DataLine] (indeps-obj@cmp)
-            (indeps) edge [DataLine] (indeps-cycle@d2)
-            % Vertical edges
-            (cycle@solver-cycle@d2) edge [DataLine] (cycle@d2)
-            (cycle@d1-cycle@solver) edge [DataLine] (cycle@solver)
-            (cycle@solver-cycle@d1) edge [DataLine] (cycle@d1)
-            (cycle@d2-cycle@solver) edge [DataLine] (cycle@solver)
-            (cycle@d1-obj@cmp) edge [DataLine] (obj@cmp)
-            (cycle@d1-con@cmp1) edge [DataLine] (con@cmp1)
-            (cycle@d1-cycle@d2) edge [DataLine] (cycle@d2)
-            (cycle@d2-obj@cmp) edge [DataLine] (obj@cmp)
-            (cycle@d2-con@cmp2) edge [DataLine] (con@cmp2)
-            (cycle@d2-cycle@d1) edge [DataLine] (cycle@d1)
-            (indeps-cycle@d1) edge [DataLine] (cycle@d1)
-            (indeps-obj@cmp) edge [DataLine] (obj@cmp)
-            (indeps-cycle@d2) edge [DataLine] (cycle@d2);
-            \end{pgfonlayer}
-
-            \end{tikzpicture}"""
-
-        def filter_lines(lns):
-            # Empty lines are excluded.
-            # Leading and trailing whitespaces are removed
-            # Comments are removed.
-            return [ln.strip() for ln in lns if ln.strip() and not ln.strip().startswith('%')]
 
         filename = 'pyxdsm_mda_tikz'
         out_format = PYXDSM_OUT
         p = om.Problem(model=SellarMDA())
         p.setup()
-        p.final_setup()
 
         # Write output
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, include_solver=True)
@@ -349,68 +570,20 @@ class TestPyXDSMViewer(unittest.TestCase):
 
         self.assertTrue(os.path.isfile(tikz_file))
 
-        sample_lines = sample_tikz_txt.split('\n')
-        sample_lines = filter_lines(sample_lines)
+        # The path of the diagram styles is different on each system, so it is not compared
+        sample_lines = [ln for ln in SAMPLE_TIKZ_LINES if not ln.startswith(r"\input{")]
 
         with open(tikz_file, "r") as f:
-            new_lines = filter_lines(f.readlines())
-
-        no_match_sample = []  # Sample text
-        no_match_new = []  # New text
+            new_lines = [ln for ln in _filter_tikz_lines(f.read().splitlines()) if not ln.startswith(r"\input{")]
 
-        for new_line, sample_line in zip(new_lines, sample_lines):
-            if new_line.startswith(r"\input{"):
-                continue
-            if new_line != sample_line:  # else everything is okay
-                # This can be because of the different ordering of lines or because of an error.
-                no_match_sample.append(new_line)
-                no_match_new.append(sample_line)
-
-        # Sort both sets of suspicious lines
-        no_match_sample.sort()
-        no_match_new.sort()
-
-        for sample_line, new_line in zip(no_match_sample, no_match_new):
-            # Now the lines should match, if only the ordering was different
-            self.assertEqual(sample_line, new_line)
-
-        # To be sure, check the length, otherwise a missing last line could get unnoticed because of using zip
-        self.assertEqual(len(new_lines), len(sample_lines))
+        # Compare the lines as multisets, so the ordering does not matter, but missing or extra
+        # (also duplicated) lines are found.
+        new_counts = Counter(new_lines)
+        sample_counts = Counter(sample_lines)
+        self.assertEqual(new_counts - sample_counts, Counter())  # Lines not in the sample
+        self.assertEqual(sample_counts - new_counts, Counter())  # Sample lines missing from the new file
 
     def test_pyxdsm_identical_relative_names(self):
-        class TimeComp(om.ExplicitComponent):
-
-            def setup(self):
-                self.add_input('t_initial', val=0.)
-                self.add_input('t_duration', val=1.)
-                self.add_output('time', shape=(2,))
-
-            def compute(self, inputs, outputs):
-                t_initial = inputs['t_initial']
-                t_duration = inputs['t_duration']
-
-                outputs['time'][0] = t_initial
-                outputs['time'][1] = t_initial + t_duration
-
-        class Phase(om.Group):
-
-            def setup(self):
-                super(Phase, self).setup()
-
-                indep = om.IndepVarComp()
-                for var in ['t_initial', 't_duration']:
-                    indep.add_output(var, val=1.0)
-
-                self.add_subsystem('time_extents', indep, promotes_outputs=['*'])
-
-                time_comp = TimeComp()
-                self.add_subsystem('time', time_comp)
-
-                self.connect('t_initial', 'time.t_initial')
-                self.connect('t_duration', 'time.t_duration')
-
-                self.set_order(['time_extents', 'time'])
-
         p = om.Problem()
         p.driver = om.ScipyOptimizeDriver()
         orbit_phase = Phase()
@@ -450,24 +623,16 @@ class TestPyXDSMViewer(unittest.TestCase):
     def test_no_indepvarcomps(self):
         p = om.Problem()
         p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        # model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
+        _add_sellar_optimization(model, x_design_var=False)
 
         p.setup()
-        p.final_setup()
 
         filename = 'pyxdsm_no_indepvarcomps'
-        write_xdsm(p, filename=filename, out_format='pdf', show_browser=SHOW, quiet=True, include_indepvarcomps=False)
+        write_xdsm(p, filename=filename, out_format=PYXDSM_OUT, show_browser=SHOW, quiet=True,
+                   include_indepvarcomps=False)
         self.assertTrue(os.path.isfile(filename + '.' + PYXDSM_OUT))
 
     def test_model_path_and_recursion(self):
-
-        import openmdao.api as om
-
         p = om.Problem()
         model = p.model
 
@@ -495,17 +660,18 @@ class TestPyXDSMViewer(unittest.TestCase):
 
         # No model path, no recursion
         write_xdsm(p, 'xdsm_circuit', out_format=PYXDSM_OUT, quiet=QUIET, show_browser=SHOW, recurse=False)
-        self.assertTrue(os.path.isfile('xdsm_circuit.' + PYXDSM_OUT))
 
         # Model path given + recursion
         write_xdsm(p, 'xdsm_circuit2', out_format=PYXDSM_OUT, quiet=QUIET, show_browser=SHOW, recurse=True,
                    model_path='G2', include_external_outputs=False)
-        self.assertTrue(os.path.isfile('xdsm_circuit2.' + PYXDSM_OUT))
 
         # Model path given + no recursion
         write_xdsm(p, 'xdsm_circuit3', out_format=PYXDSM_OUT, quiet=QUIET, show_browser=SHOW, recurse=False,
                    model_path='G1')
-        self.assertTrue(os.path.isfile('xdsm_circuit3.' + PYXDSM_OUT))
+
+        file_names = _file_names()
+        for filename in ('xdsm_circuit', 'xdsm_circuit2', 'xdsm_circuit3'):
+            self.assertIn(filename + '.' + PYXDSM_OUT, file_names)
 
         # Invalid model path, should raise error
         with self.assertRaises(ValueError):
@@ -513,8 +679,6 @@ class TestPyXDSMViewer(unittest.TestCase):
                        model_path='G3')
 
     def test_pyxdsm_solver(self):
-        import openmdao.api as om
-
         out_format = PYXDSM_OUT
         p = om.Problem()
         p.model = model = SellarNoDerivatives()
@@ -538,12 +702,37 @@ class TestPyXDSMViewer(unittest.TestCase):
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
+    def test_pyxdsm_solver_without_comps(self):
+        filename = 'pyxdsm_solver_without_comps'
+        p = om.Problem()
+        p.model.add_subsystem('comp', om.ExecComp('y=2.0*x'))
+        # Group with a non-default solver, but without components
+        empty = p.model.add_subsystem('empty', om.Group())
+        empty.nonlinear_solver = om.NonlinearBlockGS()
+        p.model.add_subsystem('comp2', om.ExecComp('y=3.0*x'))
+        p.model.connect('comp.y', 'comp2.x')
+        p.model.nonlinear_solver = om.NonlinearBlockGS()
+        p.setup()
+
+        # Write output
+        x = write_xdsm(p, filename=filename, out_format='tex', quiet=QUIET, show_browser=SHOW, include_solver=True)
+        # Check if file was created
+        self.assertTrue(os.path.isfile(filename + '.tex'))
+        # The solver without components has no loop, so it does not take a step
+        expected = [['Driver', '@auto@ivc', 'root@solver', 'Driver'],
+                    ['root@solver', 'comp', 'empty@solver', 'comp2', 'root@solver']]
+        self.assertEqual(x.processes, expected)
+        with open(filename + '.tikz') as f:
+            tikz = f.read()
+        self.assertIn(r'(root@solver) {$\text{\text{2, 6 $ \rightarrow $ 3: NL: NLBGS}}$}', tikz)
+        self.assertIn(r'(empty@solver) {$\text{\text{4: NL: NLBGS}}$}', tikz)
+        self.assertIn(r'(comp2) {$\begin{array}{c}\text{5: comp2}', tikz)
+
     def test_pyxdsm_mda(self):
         filename = 'pyxdsm_mda'
         out_format = PYXDSM_OUT
         p = om.Problem(model=SellarMDA())
         p.setup()
-        p.final_setup()
 
         # Write output
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, include_solver=True)
@@ -553,19 +742,7 @@ class TestPyXDSMViewer(unittest.TestCase):
     def test_pyxdsm_mdf(self):
         filename = 'pyxdsm_mdf'
         out_format = PYXDSM_OUT
-        p = om.Problem(model=SellarMDA())
-        model = p.model
-        p.driver = om.ScipyOptimizeDriver()
-
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]),
-                             upper=np.array([10.0, 10.0]), indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_mdf_problem
 
         # Write output
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, include_solver=True)
@@ -573,46 +750,15 @@ class TestPyXDSMViewer(unittest.TestCase):
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
     def test_parallel(self):
-        import openmdao.api as om
-
-        class SellarMDA(om.Group):
-            """
-            Group containing the Sellar MDA.
-            """
-
-            def setup(self):
-                indeps = self.add_subsystem('indeps', om.IndepVarComp(), promotes=['*'])
-                indeps.add_output('x', 1.0)
-                indeps.add_output('z', np.array([5.0, 2.0]))
-                cycle = self.add_subsystem('cycle', om.ParallelGroup(), promotes=['*'])
-                cycle.add_subsystem('d1', SellarDis1(), promotes_inputs=['x', 'z', 'y2'], promotes_outputs=['y1'])
-                cycle.add_subsystem('d2', SellarDis2(), promotes_inputs=['z', 'y1'], promotes_outputs=['y2'])
-
-                # Nonlinear Block Gauss Seidel is a gradient free solver
-                cycle.nonlinear_solver = om.NonlinearBlockGS()
-
-                self.add_subsystem('obj_cmp', om.ExecComp('obj = x**2 + z[1] + y1 + exp(-y2)',
-                                                          z=np.array([0.0, 0.0]), x=0.0),
-                                   promotes=['x', 'z', 'y1', 'y2', 'obj'])
-
-                self.add_subsystem('con_cmp1', om.ExecComp('con1 = 3.16 - y1'), promotes=['con1', 'y1'])
-                self.add_subsystem('con_cmp2', om.ExecComp('con2 = y2 - 24.0'), promotes=['con2', 'y2'])
-
         filename = 'pyxdsm_parallel'
         out_format = PYXDSM_OUT
-        p = om.Problem(model=SellarMDA())
+        p = om.Problem(model=ParallelSellarMDA())
         model = p.model
         p.driver = om.ScipyOptimizeDriver()
 
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
+        _add_sellar_optimization(model)
 
         p.setup()
-        p.final_setup()
 
         # Write output
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
@@ -631,9 +777,6 @@ class TestPyXDSMViewer(unittest.TestCase):
         p.model.add_objective('y')
         p.setup()
 
-        # Conclude setup but don't run model.
-        p.final_setup()
-
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
@@ -656,52 +799,20 @@ class TestPyXDSMViewer(unittest.TestCase):
         p.model.add_objective('y')
         p.setup()
 
-        # Conclude setup but don't run model.
-        p.final_setup()
-
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
     def test_meta_model(self):
-        import openmdao.api as om
-        from openmdao.components.tests.test_meta_model_structured_comp import SampleMap
-
         filename = 'pyxdsm_meta_model'
         out_format = PYXDSM_OUT
-        model = om.Group()
-        ivc = om.IndepVarComp()
-
-        mapdata = SampleMap()
-
-        params = mapdata.param_data
-        x, y, z = params
-        outs = mapdata.output_data
-        z = outs[0]
-        ivc.add_output('x', x['default'], units=x['units'])
-        ivc.add_output('y', y['default'], units=y['units'])
-        ivc.add_output('z', z['default'], units=z['units'])
-
-        model.add_subsystem('des_vars', ivc, promotes=["*"])
-
-        comp = om.MetaModelStructuredComp(method='slinear', extrapolate=True)
-
-        for param in params:
-            comp.add_input(param['name'], param['default'], param['values'])
-
-        for out in outs:
-            comp.add_output(out['name'], out['default'], out['values'])
-
-        model.add_subsystem('comp', comp, promotes=["*"])
-        p = om.Problem(model)
-        p.setup()
-        p.final_setup()
+        p = _meta_model_problem()
 
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
-    @unittest.skipUnless(LooseVersion(om_version) >= LooseVersion('3.2'), 'Auto-IVC introduced in OpenMDAO 3.2')
+    @unittest.skipUnless(OM_VERSION_INFO >= (3, 2), 'Auto-IVC introduced in OpenMDAO 3.2')
     def test_auto_ivc(self):
         """
         Tests a model with automatically added IndepVarComp.
@@ -724,25 +835,29 @@ class TestPyXDSMViewer(unittest.TestCase):
         p.model.add_objective('paraboloid.f')
 
         p.setup()
-        p.final_setup()
 
         # Write output
         write_xdsm(p, filename=filename, out_format=PYXDSM_OUT, show_browser=SHOW, quiet=QUIET,
                    include_indepvarcomps=False)  # Not showing the Auto IVC
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '.tex'))
-
         write_xdsm(p, filename=filename + '2', out_format=PYXDSM_OUT, show_browser=SHOW, quiet=QUIET,
                    include_indepvarcomps=True)  # Showing the Auto IVC
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '2.tex'))
+        # Check if the files were created
+        file_names = _file_names()
+        self.assertIn(filename + '.tex', file_names)
+        self.assertIn(filename + '2.tex', file_names)
 
 
-@use_tempdirs
+@_tempdirs_decorator
 class TestXDSMjsViewer(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        # Sellar problems shared by the tests, which do not modify the model
+        cls.sellar_problem = _sellar_problem()
+        cls.sellar_mdf_problem = _sellar_mdf_problem()
+
     def test_xdsmjs(self):
         """
         Makes XDSMjs input file for the Sellar problem.
@@ -751,24 +866,15 @@ class TestXDSMjsViewer(unittest.TestCase):
         """
 
         filename = 'xdsmjs'  # this name is needed for XDSMjs
-        p = om.Problem()
-        p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_problem
 
         # Write output
         write_xdsm(p, filename=filename, out_format='html', subs=(), show_browser=SHOW, embed_data=False)
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '.json'))
-        self.assertTrue(os.path.isfile(filename + '.html'))
+        # Check if the files were created
+        file_names = _file_names()
+        self.assertIn(filename + '.json', file_names)
+        self.assertIn(filename + '.html', file_names)
 
     def test_xdsmjs_embed_data(self):
         """
@@ -778,17 +884,7 @@ class TestXDSMjsViewer(unittest.TestCase):
         """
 
         filename = 'xdsmjs_embedded'  # this name is needed for XDSMjs
-        p = om.Problem()
-        p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_problem
 
         # Write output
         write_xdsm(p, filename=filename, out_format='html', subs=(), show_browser=SHOW, embed_data=True)
@@ -804,17 +900,7 @@ class TestXDSMjsViewer(unittest.TestCase):
         """
 
         filename = 'xdsmjs_embeddable'  # this name is needed for XDSMjs
-        p = om.Problem()
-        p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_problem
 
         # Write output
         write_xdsm(p, filename=filename, out_format='html', subs=(), show_browser=SHOW, embed_data=True,
@@ -883,40 +969,32 @@ class TestXDSMjsViewer(unittest.TestCase):
 
         self.assertTrue(os.path.isfile(outfile))
 
-    def test_pyxdsm_identical_relative_names(self):
-        class TimeComp(om.ExplicitComponent):
-
-            def setup(self):
-                self.add_input('t_initial', val=0.)
-                self.add_input('t_duration', val=1.)
-                self.add_output('time', shape=(2,))
-
-            def compute(self, inputs, outputs):
-                t_initial = inputs['t_initial']
-                t_duration = inputs['t_duration']
-
-                outputs['time'][0] = t_initial
-                outputs['time'][1] = t_initial + t_duration
-
-        class Phase(om.Group):
+    def test_html_writer_quotes(self):
+        """
+        Quote marks in the embedded data are replaced, and the characters before them are kept.
+        """
 
-            def setup(self):
-                super(Phase, self).setup()
+        filename = 'xdsmjs_quotes'
 
-                indep = om.IndepVarComp()
-                for var in ['t_initial', 't_duration']:
-                    indep.add_output(var, val=1.0)
+        data = {"nodes": [{"id": "Mu", "name": "mu"}, {"id": "Df", "name": "f'"}], "edges": [], "workflow": []}
 
-                self.add_subsystem('time_extents', indep, promotes_outputs=['*'])
+        outfile = filename + '.html'
+        write_html(outfile=outfile, source_data=data)
 
-                time_comp = TimeComp()
-                self.add_subsystem('time', time_comp)
+        with open(outfile) as f:
+            html = f.read()
+        self.assertIn('&quot;mu&quot;', html)
+        self.assertIn("&quot;f'&quot;", html)  # Apostrophe in a dictionary value is kept
 
-                self.connect('t_initial', 'time.t_initial')
-                self.connect('t_duration', 'time.t_duration')
+        # Already escaped string data is embedded without changes
+        data_str = "{&quot;nodes&quot;: [], &quot;edges&quot;: [], &quot;workflow&quot;: []}"
+        write_html(outfile=outfile, source_data=data_str, source_is_escaped=True)
 
-                self.set_order(['time_extents', 'time'])
+        with open(outfile) as f:
+            html = f.read()
+        self.assertIn('data-mdo="{}"'.format(data_str), html)
 
+    def test_pyxdsm_identical_relative_names(self):
         p = om.Problem()
         p.driver = om.ScipyOptimizeDriver()
         orbit_phase = Phase()
@@ -942,7 +1020,6 @@ class TestXDSMjsViewer(unittest.TestCase):
         out_format = 'html'
         prob = om.Problem(model=SellarMDA())
         prob.setup()
-        prob.final_setup()
 
         # Write output
         write_xdsm(prob, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, embed_data=True,
@@ -953,19 +1030,7 @@ class TestXDSMjsViewer(unittest.TestCase):
     def test_xdsmjs_mdf(self):
         filename = 'xdsmjs_mdf'
         out_format = 'html'
-        p = om.Problem(model=SellarMDA())
-        model = p.model
-        p.driver = om.ScipyOptimizeDriver()
-
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_mdf_problem
 
         # Write output
         write_xdsm(p, filename=filename, out_format=out_format, show_browser=SHOW, include_solver=True)
@@ -973,8 +1038,6 @@ class TestXDSMjsViewer(unittest.TestCase):
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
     def test_xdsm_solver(self):
-        import openmdao.api as om
-
         filename = 'xdsmjs_solver'
         out_format = 'html'
         p = om.Problem(model=SellarNoDerivatives())
@@ -990,47 +1053,107 @@ class TestXDSMjsViewer(unittest.TestCase):
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
-    def test_parallel(self):
-        import openmdao.api as om
-
-        class SellarMDA(om.Group):
-            """
-            Group containing the Sellar MDA.
-            """
-
-            def setup(self):
-                indeps = self.add_subsystem('indeps', om.IndepVarComp(), promotes=['*'])
-                indeps.add_output('x', 1.0)
-                indeps.add_output('z', np.array([5.0, 2.0]))
-                cycle = self.add_subsystem('cycle', om.ParallelGroup(), promotes=['*'])
-                cycle.add_subsystem('d1', SellarDis1(), promotes_inputs=['x', 'z', 'y2'], promotes_outputs=['y1'])
-                cycle.add_subsystem('d2', SellarDis2(), promotes_inputs=['z', 'y1'], promotes_outputs=['y2'])
+    def test_xdsmjs_sibling_solvers(self):
+        filename = 'xdsmjs_sibling_solvers'
+        out_format = 'html'
+        p = om.Problem()
+        par = p.model.add_subsystem('par', om.Group())
+        for name in ('g1', 'g2'):
+            group = par.add_subsystem(name, om.Group())
+            group.add_subsystem('comp', om.ExecComp('y=2.0*x'))
+            group.add_subsystem('comp2', om.ExecComp('y=3.0*x'))
+            group.connect('comp.y', 'comp2.x')
+            group.nonlinear_solver = om.NonlinearBlockGS()
+        p.setup()
 
-                # Nonlinear Block Gauss Seidel is a gradient free solver
-                cycle.nonlinear_solver = om.NonlinearBlockGS()
+        # Write output
+        x = write_xdsm(p, filename=filename, out_format=out_format, show_browser=SHOW, include_solver=True)
+        # Check if file was created
+        self.assertTrue(os.path.isfile(filename + '.' + out_format))
+        # Both solver loops are nested into the driver workflow
+        expected = ['Driver', ['@auto@ivc',
+                               'par@g1@solver', ['par@g1@comp', 'par@g1@comp2'],
+                               'par@g2@solver', ['par@g2@comp', 'par@g2@comp2']]]
+        self.assertEqual(x.processes, expected)
+
+    def test_xdsmjs_model_path_external_connections(self):
+        filename = 'xdsmjs_model_path'
+        out_format = 'html'
+        p = self.sellar_problem
 
-                self.add_subsystem('obj_cmp', om.ExecComp('obj = x**2 + z[1] + y1 + exp(-y2)',
-                                                          z=np.array([0.0, 0.0]), x=0.0),
-                                   promotes=['x', 'z', 'y1', 'y2', 'obj'])
+        # Write output, the cycle has external inputs and outputs
+        x = write_xdsm(p, filename=filename, out_format=out_format, show_browser=SHOW, model_path='cycle',
+                       include_external_outputs=True)
+        # Check if file was created
+        self.assertTrue(os.path.isfile(filename + '.' + out_format))
+        # The labels of the external inputs and outputs are the variable names
+        external_edges = [e for e in x.connections if x._ul in (e['from'], e['to'])]
+        self.assertTrue(external_edges)
+        for edge in external_edges:
+            self.assertIsInstance(edge['name'], list)
+
+    def test_xdsmjs_dedupe_edges(self):
+        filename = 'xdsmjs_dedupe_edges'
+        out_format = 'html'
+        p = self.sellar_problem
+
+        # Write output, the solver has several connections to the same components
+        x = write_xdsm(p, filename=filename, out_format=out_format, show_browser=SHOW, include_solver=True)
+        edges = Counter((e['from'], e['to']) for e in x.connections)
+        self.assertGreater(max(edges.values()), 1)
+
+        x = write_xdsm(p, filename=filename, out_format=out_format, show_browser=SHOW, include_solver=True,
+                       writer_options={'dedupe_edges': True})
+        deduped_edges = Counter((e['from'], e['to']) for e in x.connections)
+        self.assertEqual(set(deduped_edges), set(edges))
+        self.assertEqual(max(deduped_edges.values()), 1)
+        # Check if file was created
+        self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
-                self.add_subsystem('con_cmp1', om.ExecComp('con1 = 3.16 - y1'), promotes=['con1', 'y1'])
-                self.add_subsystem('con_cmp2', om.ExecComp('con2 = y2 - 24.0'), promotes=['con2', 'y2'])
+    def test_xdsmjs_json_without_orjson(self):
+        # The JSON data is the same with the json module as with orjson (if it is installed)
+        def make_writer():
+            x = XDSMjsWriter()
+            x.add_comp(name='comp', label='Größe')
+            x.add_input('comp', label='"x"')
+            return x
+
+        def read(filename):
+            with open(filename, 'rb') as f:
+                return f.read()
+
+        def write(filename, embed_data):
+            make_writer().write(filename, embed_data=embed_data)
+            return read(filename + ('.html' if embed_data else '.json'))
+
+        def write_dct(filename):
+            # write_html embeds a dictionary with the same encoder as the writer
+            write_html(outfile=filename + '.html', source_data=make_writer().collect_data())
+            return read(filename + '.html')
+
+        with mock.patch.object(html_writer, 'orjson', None):
+            json_data = write('xdsmjs_json', embed_data=False)
+            html_data = write('xdsmjs_json_embedded', embed_data=True)
+            self.assertEqual(write_dct('xdsmjs_json_dct'), html_data)
+        # Compact and the non-ASCII characters are not escaped
+        self.assertIn('"name":"Größe"'.encode('utf-8'), json_data)
+        self.assertIn('&quot;name&quot;:&quot;Größe&quot;'.encode('utf-8'), html_data)
+
+        if html_writer.orjson is not None:
+            self.assertEqual(write('xdsmjs_orjson', embed_data=False), json_data)
+            self.assertEqual(write('xdsmjs_orjson_embedded', embed_data=True), html_data)
+            self.assertEqual(write_dct('xdsmjs_orjson_dct'), html_data)
 
+    def test_parallel(self):
         filename = 'xdsmjs_parallel'
         out_format = 'html'
-        p = om.Problem(model=SellarMDA())
+        p = om.Problem(model=ParallelSellarMDA())
         model = p.model
         p.driver = om.ScipyOptimizeDriver()
 
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
+        _add_sellar_optimization(model)
 
         p.setup()
-        p.final_setup()
 
         # Write output
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
@@ -1049,9 +1172,6 @@ class TestXDSMjsViewer(unittest.TestCase):
         p.model.add_objective('y')
         p.setup()
 
-        # Conclude setup but don't run model.
-        p.final_setup()
-
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
@@ -1068,46 +1188,14 @@ class TestXDSMjsViewer(unittest.TestCase):
         p.model.add_objective('y')
         p.setup()
 
-        # Conclude setup but don't run model.
-        p.final_setup()
-
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
         # Check if file was created
         self.assertTrue(os.path.isfile(filename + '.' + out_format))
 
     def test_meta_model(self):
-        import openmdao.api as om
-        from openmdao.components.tests.test_meta_model_structured_comp import SampleMap
-
         filename = 'xdsmjs_meta_model'
         out_format = 'html'
-        model = om.Group()
-        ivc = om.IndepVarComp()
-
-        mapdata = SampleMap()
-
-        params = mapdata.param_data
-        x, y, z = params
-        outs = mapdata.output_data
-        z = outs[0]
-        ivc.add_output('x', x['default'], units=x['units'])
-        ivc.add_output('y', y['default'], units=y['units'])
-        ivc.add_output('z', z['default'], units=z['units'])
-
-        model.add_subsystem('des_vars', ivc, promotes=["*"])
-
-        comp = om.MetaModelStructuredComp(method='slinear', extrapolate=True)
-
-        for param in params:
-            comp.add_input(param['name'], param['default'], param['values'])
-
-        for out in outs:
-            comp.add_output(out['name'], out['default'], out['values'])
-
-        model.add_subsystem('comp', comp, promotes=["*"])
-        p = om.Problem(model)
-        p.setup()
-        p.final_setup()
+        p = _meta_model_problem()
 
         write_xdsm(p, filename=filename, out_format=out_format, quiet=QUIET, show_browser=SHOW, show_parallel=True)
         # Check if file was created
@@ -1115,9 +1203,6 @@ class TestXDSMjsViewer(unittest.TestCase):
 
     def test_circuit_recurse(self):
         # Implicit component is also tested here
-
-        import openmdao.api as om
-
         p = om.Problem()
         model = p.model
 
@@ -1144,8 +1229,6 @@ class TestXDSMjsViewer(unittest.TestCase):
         self.assertTrue(os.path.isfile('xdsmjs_circuit' + '.html'))
 
     def test_legend_and_class_names(self):
-        import openmdao.api as om
-
         p = om.Problem()
         model = p.model
 
@@ -1170,26 +1253,18 @@ class TestXDSMjsViewer(unittest.TestCase):
 
         write_xdsm(p, 'xdsmjs_circuit_legend', out_format='html', quiet=QUIET, show_browser=SHOW, recurse=True,
                    legend=True)
-        self.assertTrue(os.path.isfile('xdsmjs_circuit_legend' + '.html'))
 
         write_xdsm(p, 'xdsmjs_circuit_class_names', out_format='html', quiet=QUIET, show_browser=SHOW, recurse=True,
                    class_names=True)
-        self.assertTrue(os.path.isfile('xdsmjs_circuit_class_names' + '.html'))
+
+        file_names = _file_names()
+        self.assertIn('xdsmjs_circuit_legend.html', file_names)
+        self.assertIn('xdsmjs_circuit_class_names.html', file_names)
 
     def test_xdsmjs_right_outputs(self):
         """Makes XDSM for the Sellar problem"""
         filename = 'xdsmjs_outputs_on_the_right'
-        p = om.Problem()
-        p.model = model = SellarNoDerivatives()
-        model.add_design_var('z', lower=np.array([-10.0, 0.0]), upper=np.array([10.0, 10.0]),
-                             indices=np.arange(2, dtype=int))
-        model.add_design_var('x', lower=0.0, upper=10.0)
-        model.add_objective('obj')
-        model.add_constraint('con1', equals=np.zeros(1))
-        model.add_constraint('con2', upper=0.0)
-
-        p.setup()
-        p.final_setup()
+        p = self.sellar_problem
 
         msg = 'Right side outputs not implemented for XDSMjs.'
 
@@ -1208,7 +1283,6 @@ class TestXDSMjsViewer(unittest.TestCase):
         prob.model = SellarNoDerivatives()
 
         prob.setup()
-        prob.final_setup()
 
         # no output checking, just make sure no exceptions raised
         with self.assertRaises(ValueError):
@@ -1222,7 +1296,7 @@ class TestXDSMjsViewer(unittest.TestCase):
         filename = os.path.abspath(sellar.__file__)
         check_call('openmdao xdsm --no_browser {}'.format(filename))
 
-    @unittest.skipUnless(LooseVersion(om_version) >= LooseVersion('3.2'), 'Auto-IVC introduced in OpenMDAO 3.2')
+    @unittest.skipUnless(OM_VERSION_INFO >= (3, 2), 'Auto-IVC introduced in OpenMDAO 3.2')
     def test_auto_ivc(self):
         """
         Tests a model with automatically added IndepVarComp.
@@ -1245,24 +1319,22 @@ class TestXDSMjsViewer(unittest.TestCase):
         p.model.add_objective('paraboloid.f')
 
         p.setup()
-        p.final_setup()
 
         # Write output
         write_xdsm(p, filename=filename, out_format='html', show_browser=SHOW, quiet=QUIET,
                    include_indepvarcomps=False)  # Not showing the Auto IVC
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '.html'))
-
         write_xdsm(p, filename=filename + '2', out_format='html', show_browser=SHOW, quiet=QUIET,
                    include_indepvarcomps=True)  # Showing the Auto IVC
 
-        # Check if file was created
-        self.assertTrue(os.path.isfile(filename + '2.html'))
+        # Check if the files were created
+        file_names = _file_names()
+        self.assertIn(filename + '.html', file_names)
+        self.assertIn(filename + '2.html', file_names)
 
 
 @unittest.skipUnless(XDSM, "The pyXDSM package is required.")
-@use_tempdirs
+@_tempdirs_decorator
 class TestCustomXDSMViewer(unittest.TestCase):
 
     def test_custom_writer(self):
@@ -1280,7 +1352,6 @@ class TestCustomXDSMViewer(unittest.TestCase):
         p.model = SellarNoDerivatives()
 
         p.setup()
-        p.final_setup()
 
         my_writer = CustomWriter()
         filename = 'xdsm_custom_writer'  # this name is needed for XDSMjs
@@ -14,17 +14,30 @@ The pyXDSM package is available at https://github.com/mdolab/pyXDSM.
 XDSMjs is available at https://github.com/OneraHub/XDSMjs.
 """
 
-import json
-from collections import OrderedDict
-from distutils.version import LooseVersion
+import copy
+import os
+import re
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from functools import lru_cache
+from itertools import accumulate
+from shutil import which
 
-from numpy.distutils.exec_command import find_executable
-from openmdao.api import Problem
 from openmdao.utils.general_utils import simple_warning
-from openmdao.visualization.n2_viewer.n2_viewer import _get_viewer_data
 from pyxdsm.XDSM import XDSM
 
-from omxdsm.html_writer import write_html
+from omxdsm.html_writer import write_html, _dumps_json
+
+try:
+    from pyxdsm import __version__ as _PYXDSM_VERSION
+except ImportError:
+    # Older pyxdsm did not have a version attribute
+    _PYXDSM_VERSION = '1.0.0'
+
+# Version of pyXDSM as a tuple of integers, e.g. (2, 2, 1), and the version dependent features
+_PYXDSM_VERSION_INFO = tuple(int(n) for n in re.findall(r'\d+', _PYXDSM_VERSION)[:3])
+_PYXDSM_GT_1 = _PYXDSM_VERSION_INFO > (1, 0, 0)  # Takes keyword arguments and has processes
+_PYXDSM_LT_2 = _PYXDSM_VERSION_INFO < (2, 0, 0)  # Uses the legacy color scheme
 
 # Writer is chosen based on the output format
 _OUT_FORMATS = {'tex': 'pyxdsm', 'pdf': 'pyxdsm', 'json': 'xdsmjs', 'html': 'xdsmjs'}
@@ -33,6 +46,9 @@ _OUT_FORMATS = {'tex': 'pyxdsm', 'pdf': 'pyxdsm', 'json': 'xdsmjs', 'html': 'xds
 # Last item (initial0) is used to pass the character substitution  step without changes in the string.
 # This string won't appear on the XDSM. Variable names should not contain this substring.
 _SUPERSCRIPTS = {'optimal': '*', 'initial': '(0)', 'target': 't', 'consistency': 'c', 'initial0': '#INIT#'}
+# Superscripts appended to the variable names, with the default superscripts
+_SUPERSCRIPT_STRS = {var_type: '^{}'.format(sup) for var_type, sup in _SUPERSCRIPTS.items()}
+_TEX_SUPERSCRIPT_STRS = {var_type: '^{{{}}}'.format(sup) for var_type, sup in _SUPERSCRIPTS.items()}
 
 # Character substitutions in labels
 # pyXDSM:
@@ -55,11 +71,23 @@ _CHAR_SUBS = {
         (_SUPERSCRIPTS['initial0'], _SUPERSCRIPTS['initial'])
     ),
 }
+# Characters not allowed in pyXDSM component and connection names. These are replaced with "@".
+_ILLEGAL_CHARS = ('.', ' ', '-', '_', ':')
+_ILLEGAL_CHARS_TABLE = str.maketrans(dict.fromkeys(_ILLEGAL_CHARS, '@'))
+# Index brackets in the equations of ExecComps are converted to lower indices in LaTeX
+_INDEX_BRACKETS = str.maketrans({'[': '_', ']': ''})
 _AUTO_IVC_NAME = '@auto@ivc'
+# Owner component of the Auto-IVC outputs, as _convert_name returns it (before the illegal characters are replaced)
+_AUTO_IVC_COMP = _AUTO_IVC_NAME.replace('@', '_')
 _CONNECTION_NAMING = 'mixed'  # Auto-IVC connections inherit the name from the target, if it is set to 'mixed'
 
 # Default solver names in OpenMDAO, when no solver is assigned to a system.
 _DEFAULT_SOLVER_NAMES = {'linear': 'LN: RUNONCE', 'nonlinear': 'NL: RUNONCE'}
+# Keys of the solver names in the model tree data, e.g. "linear_solver"
+_SOLVER_KEYS = {solver_type: '{}_solver'.format(solver_type) for solver_type in _DEFAULT_SOLVER_NAMES}
+# Pairs of the solver keys in the model tree data and the default solver names
+_SOLVER_KEY_DEFAULTS = tuple((_SOLVER_KEYS[solver_type], default_solver)
+                             for solver_type, default_solver in _DEFAULT_SOLVER_NAMES.items())
 # On which side to place outputs? One of "left", "right"
 _DEFAULT_OUTPUT_SIDE = 'left'
 # Default writer, this will be used if settings are not found for a custom writer
@@ -138,9 +166,11 @@ class BaseXDSMWriter(object):
         Output file saved with this extension.
     type_map : str
         XDSM component type.
+    options : dict
+        Writer options.
     """
 
-    def __init__(self, name, options={}):
+    def __init__(self, name, options=None):
         """
         Initialize.
 
@@ -148,10 +178,11 @@ class BaseXDSMWriter(object):
         ----------
         name : str
             Name of this XDSM writer
-        options : dict
+        options : dict or None, optional
             Writer options.
         """
         self.name = name
+        self.options = {} if options is None else options
         # This should be a dictionary mapping OpenMDAO system types to XDSM component types.
         # See for example any value in _COMPONENT_TYPE_MAP
         self.type_map = None
@@ -174,7 +205,7 @@ class AbstractXDSMWriter(BaseXDSMWriter):
         List of process.
     """
 
-    def __init__(self, name='abstract_xdsm_writer'):
+    def __init__(self, name='abstract_xdsm_writer', options=None):
         """
         Initialize.
 
@@ -182,8 +213,10 @@ class AbstractXDSMWriter(BaseXDSMWriter):
         ----------
         name : str
             Name of XDSM writer.
+        options : dict or None, optional
+            Writer options.
         """
-        super(AbstractXDSMWriter, self).__init__(name=name)
+        super(AbstractXDSMWriter, self).__init__(name=name, options=options)
         self.comps = []
         self.connections = []
         self.processes = []
@@ -329,8 +362,8 @@ class AbstractXDSMWriter(BaseXDSMWriter):
         str
             Formatted var string.
         """
-        if superscripts is None:
-            superscripts = _SUPERSCRIPTS
+        if superscripts is None:  # Default superscripts are preformatted
+            return name + _SUPERSCRIPT_STRS[var_type]
         sup = superscripts[var_type]
         return '{}^{}'.format(name, sup)
 
@@ -366,9 +399,16 @@ class XDSMjsWriter(AbstractXDSMWriter):
         XDSM component type.
     class_names : bool
         Include class names of components in diagonal blocks.
+    _proc_parent : dict
+        Maps the names in the workflow to the process list, which contains them.
+    _id_cache : dict
+        Formatted ids of the names and substitutions.
+    _edge_index : dict
+        Index of the edge in the connections for each (source, target) pair, if the
+        "dedupe_edges" option is set.
     """
 
-    def __init__(self, name='xdsmjs', class_names=False, options={}):
+    def __init__(self, name='xdsmjs', class_names=False, options=None):
         """
         Initialize.
 
@@ -378,10 +418,10 @@ class XDSMjsWriter(AbstractXDSMWriter):
             Name of this XDSM writer
         class_names : bool
             Include class names of the components in the diagonal
-        options : dict
+        options : dict or None, optional
             Writer options.
         """
-        super(XDSMjsWriter, self).__init__(name=name)
+        super(XDSMjsWriter, self).__init__(name=name, options=options)
         self.driver = 'opt'  # Driver default name
         self.comp_names = []  # Component names
         self._ul = '_U_'  # Name of the virtual first element
@@ -397,13 +437,22 @@ class XDSMjsWriter(AbstractXDSMWriter):
             msg = 'Name "{}" not found in component type mapping, will default to "{}"'
             simple_warning(msg.format(self.name, _DEFAULT_WRITER))
         self.class_names = class_names
+        self._proc_parent = {}  # Process list, which contains the name, for each name in processes
+        self._id_cache = {}  # Formatted ids of the names
+        self._edge_index = {}  # Index of the edges, if connections between the same blocks are merged
 
     def _format_id(self, name, subs=(('_', ''),)):
         # Changes forbidden characters in the "id" of a component
-        if name not in self.reserved_words:
-            return _replace_chars(name, subs)
-        else:
-            return name
+        # The same names are formatted for every connection, so the results are stored
+        key = name, subs
+        formatted = self._id_cache.get(key)
+        if formatted is None:
+            if name not in self.reserved_words:
+                formatted = _replace_chars(name, subs)
+            else:
+                formatted = name
+            self._id_cache[key] = formatted
+        return formatted
 
     def connect(self, src, target, label, **kwargs):
         """
@@ -421,6 +470,15 @@ class XDSMjsWriter(AbstractXDSMWriter):
             Keyword args
         """
         edge = {'to': self._format_id(target), 'from': self._format_id(src), 'name': label}
+        if self.options.get('dedupe_edges', False):
+            # Connections between the same blocks are merged into one edge
+            key = edge['from'], edge['to']
+            index = self._edge_index.get(key)
+            if index is not None:
+                existing = self.connections[index]
+                existing['name'] = _merge_labels(existing['name'], label)
+                return
+            self._edge_index[key] = len(self.connections)
         self.connections.append(edge)
 
     def add_solver(self, name, label=None, **kwargs):
@@ -518,26 +576,22 @@ class XDSMjsWriter(AbstractXDSMWriter):
         solver : dict or None, optional
             Solver info.
         """
-        def recurse(solv, nr, process):
-            for i, cmp in enumerate(process, start=1):
-                if cmp == solv:
-                    process[i:i + nr] = [process[i:i + nr]]
-                    return
-                elif isinstance(cmp, list):
-                    recurse(solv, nr, cmp)
-                    break
-
-        if solver is None:
-            comp_names = self.comp_names
-            solver_name = None
-        else:
-            solver_name = solver['abs_name']
-            comp_names = [c['abs_name'] for c in solver['comps']]
-        nr_comps = len(comp_names)
-
         if not self.processes:  # If no process was added yet, add the process of the driver
             self.processes = [self.driver, list(self.comp_names)]
-        recurse(solver_name, nr_comps, self.processes)  # Mutates self.processes
+            self._proc_parent = {self.driver: self.processes}
+            self._proc_parent.update((name, self.processes[1]) for name in self.processes[1])
+
+        if solver is not None:
+            solver_name = solver['abs_name']
+            process = self._proc_parent.get(solver_name)
+            if process is not None:
+                # The components of the solver follow its name in the same process
+                nr_comps = len(solver['comps'])
+                i = process.index(solver_name) + 1
+                sub_process = process[i:i + nr_comps]
+                process[i:i + nr_comps] = [sub_process]  # Mutates self.processes
+                self._proc_parent.update((name, sub_process) for name in sub_process
+                                         if not isinstance(name, list))
 
     def add_input(self, name, label=None, style='DataIO', stack=False):
         """
@@ -616,11 +670,14 @@ class XDSMjsWriter(AbstractXDSMWriter):
 
         embeddable = kwargs.pop('embeddable', False)
         if embed_data:
-            write_html(outfile=html_filename, source_data=data, embeddable=embeddable)  # Write HTML file
+            # Serialized as JSON, so only the double quotes have to be replaced for the HTML
+            data = _dumps_json(data).replace('"', '&quot;')
+            write_html(outfile=html_filename, source_data=data, embeddable=embeddable,
+                       source_is_escaped=True)  # Write HTML file
         else:
             json_filename = '.'.join([filename, 'json'])
-            with open(json_filename, 'w') as f:
-                json.dump(data, f)
+            with open(json_filename, 'w', encoding='utf-8') as f:
+                f.write(_dumps_json(data))  # Serialized first, so the file is written at once
             write_html(outfile=html_filename, data_file=json_filename, embeddable=embeddable)  # Write HTML file
         print('XDSM output file written to: {}'.format(html_filename))
 
@@ -659,6 +716,8 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
         Output file saved with this extension. Value fixed at 'pdf' for this class.
     type_map : str
         XDSM component type.
+    options : dict
+        Keyword argument options of the XDSM class.
     _comp_indices : dict
         Maps the component names to their index (position on the matrix diagonal).
     _styles_used : set
@@ -667,6 +726,8 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
         List of component dictionaries.
     _loop_ends : list
         Index of last components in a process.
+    _process_index : dict
+        Maps the component names to the processes, which contain them (not as the first item).
     _nr_comps : int
         Number of components.
     _pyxdsm_version : str
@@ -675,7 +736,7 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
 
     def __init__(self, name='pyxdsm', box_stacking=_DEFAULT_BOX_STACKING,
                  number_alignment=_DEFAULT_NUMBER_ALIGNMENT, legend=False, class_names=False,
-                 add_component_indices=True, options={}):
+                 add_component_indices=True, options=None):
         """
         Initialize.
 
@@ -696,27 +757,25 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
             Defaults to False.
         add_component_indices : bool
             If true, display components with numbers.
-        options : dict
+        options : dict or None, optional
             Keyword argument options of the XDSM class.
         """
-        try:
-            from pyxdsm import __version__ as pyxdsm_version
-            self._pyxdsm_version = pyxdsm_version
-        except ImportError:
-            # Older pyxdsm did not have a version attribute
-            self._pyxdsm_version = '1.0.0'
-            pyxdsm_version = LooseVersion(self._pyxdsm_version)
+        if options is None:
+            options = {}
+        self._pyxdsm_version = _PYXDSM_VERSION
 
-        if pyxdsm_version > LooseVersion('1.0.0'):
+        if _PYXDSM_GT_1:
             super(XDSMWriter, self).__init__(**options)
         else:
             if options:
                 msg = 'pyXDSM {} does not take keyword arguments. Consider upgrading this ' \
                       'package. Writer options "{}" will be ignored'
-                simple_warning(msg.format(pyxdsm_version, options.keys()))
+                simple_warning(msg.format(_PYXDSM_VERSION, options.keys()))
             super(XDSMWriter, self).__init__()
 
         self.name = name
+        # BaseXDSMWriter.__init__ is not called, the XDSM options are stored here as the writer options
+        self.options = options
         # Formatting options
         self.box_stacking = box_stacking
         self.class_names = class_names
@@ -728,7 +787,7 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
 
         try:
             type_map_name = self.name
-            if pyxdsm_version < LooseVersion('2.0.0'):
+            if _PYXDSM_LT_2:
                 type_map_name += ' 1.0'
             self.type_map = _COMPONENT_TYPE_MAP[type_map_name]
         except KeyError:
@@ -743,6 +802,8 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
         self._comps = []
         # Index of last components in a process
         self._loop_ends = []
+        # Processes, which contain the component (not as the first item), for each component name
+        self._process_index = {}
         # Styles in use (needed for legend)
         self._styles_used = set()
 
@@ -760,40 +821,53 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
             Keyword args
         """
         build = kwargs.pop('build', False)
-        if LooseVersion(self._pyxdsm_version) <= LooseVersion('1.0.0'):
+        if not _PYXDSM_GT_1:
             kwargs = {}
         else:
             kwargs.setdefault('cleanup', True)
 
-        for comp in self._comps:
-            label = comp['label']
-            # If the process steps are included in the labels
-            if self.add_component_indices:
-                i = i0 = comp.pop('index', None)
-                step = comp.pop('step', None)
-                # For each closed loop increment the process index by one
-                for loop in self._loop_ends:
-                    if loop < i0:
-                        i += 1
-                # Step is not None for the driver and solvers, for these a different label
-                # will be made showing the starting end and step and the index of the next
-                # step.
-                if step is not None:
-                    i = self._make_loop_str(first=i, last=step, start_index=_START_INDEX)
-            else:
-                i = None
-            label = self.finalize_label(i, label, self.number_alignment,
-                                        class_name=comp['class'])
+        # If the process steps are included in the labels, the numbers are made first. The loops
+        # are sorted only in this case.
+        if self.add_component_indices:
+            numbers = self._make_numbers()
+        else:
+            numbers = [None] * len(self._comps)
+        # Bound once, these are used for every component
+        add_system = self.add_system
+        finalize_label = self.finalize_label
+        number_alignment = self.number_alignment
+        for comp, i in zip(self._comps, numbers):
+            label = finalize_label(i, comp['label'], number_alignment, class_name=comp['class'])
 
             # Convert from math mode to regular text, if it is a one liner wrapped in math mode
             if isinstance(label, str):
                 label = _textify(label)
-            comp['label'] = label  # Now the label is finished.
-            # Now really add the system with the XDSM class' method
-            self.add_system(**comp)
+            # Now the label is finished, really add the system with the XDSM class' method
+            # The component dictionary is not modified, only the arguments of the system are passed
+            add_system(node_name=comp['node_name'], style=comp['style'], label=label,
+                       stack=comp['stack'], faded=comp['faded'])
 
         super(XDSMWriter, self).write(file_name=filename, build=build, **kwargs)
 
+    def _make_numbers(self):
+        # Returns the process index of each component, or the loop string for the driver and
+        # solvers.
+        loop_ends = sorted(self._loop_ends)
+        make_loop_str = self._make_loop_str
+        numbers = []
+        for comp in self._comps:
+            i0 = comp['index']
+            step = comp.get('step')
+            # For each closed loop before the component increment the process index by one
+            i = i0 + bisect_left(loop_ends, i0)
+            # Step is not None for the driver and solvers, for these a different label
+            # will be made showing the starting end and step and the index of the next
+            # step.
+            if step is not None:
+                i = make_loop_str(first=i, last=step, start_index=_START_INDEX)
+            numbers.append(i)
+        return numbers
+
     def add_system(self, node_name, style, label, stack=False, faded=False, **kwargs):
         """
         Add a system.
@@ -907,23 +981,28 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
             else:
                 solver_name = solver['abs_name']
                 comp_names = [c['abs_name'] for c in solver['comps']]
+                if not comp_names:  # Nothing to loop over, the process would be a single block
+                    return
                 nr = len(comp_names)
                 idx = index_dct[solver_name]
                 self._comps[idx]['step'] = nr + idx + 1
                 comp_names = [solver_name] + comp_names
-                # Loop through all processes added so far
+                # Loop through the processes added so far, which contain the solver
                 # Assumes, that processes are added in the right order, first the higher level
                 # processes
-                for proc in self.processes:
-                    process_name = proc[0]
-                    for i, item in enumerate(proc, start=1):
-                        if solver_name == item:  # solver found in an already added process
-                            # Delete items belonging to the new process from the others
-                            proc[i:i + nr] = []
-                            process_index = index_dct[process_name]
-                            # There is a process loop inside, this adds plus one step
-                            self._comps[process_index]['step'] += 1
+                for proc in self._process_index.get(solver_name, []):
+                    i = proc.index(solver_name, 1) + 1
+                    # Delete items belonging to the new process from the others
+                    for name in proc[i:i + nr]:
+                        self._process_index[name] = [p for p in self._process_index.get(name, [])
+                                                     if p is not proc]
+                    proc[i:i + nr] = []
+                    process_index = index_dct[proc[0]]
+                    # There is a process loop inside, this adds plus one step
+                    self._comps[process_index]['step'] += 1
             self._loop_ends.append(self._comp_indices[comp_names[-1]])
+            for name in comp_names[1:]:
+                self._process_index.setdefault(name, []).append(comp_names)
             # Close the loop by
             comp_names.append(comp_names[0])
             self.add_process(comp_names, arrow=_PROCESS_ARROWS)
@@ -964,29 +1043,27 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
             max_chars = kwargs.pop('box_width', _DEFAULT_BOX_CHAR_LIMIT)
             if len(names) < 2:
                 return names
+            elif stacking == 'cut_chars':
+                # Number of names, which fit into the line
+                nr_names = bisect_right(list(accumulate(map(len, names))), max_chars)
+                if nr_names == len(names):
+                    return ', '.join(names)
+                return ', '.join(names[:nr_names]) + end_str
             else:
                 lengths = 0
                 lines = list()
-                line = ''
+                line_names = []  # Names on the current line
                 for name in names:
                     lengths += len(name)
                     if lengths <= max_chars:
-                        if line:  # there are already var names on the line
-                            line += ', ' + name
-                        else:  # it will be the first var name on the line
-                            line = name
+                        line_names.append(name)
                     else:  # make new line
-                        if stacking == 'max_chars':
-                            if line:
-                                lines.append(line)
-                            line = name
-                            lengths = len(name)
-                        else:  # 'cut_chars'
-                            lines.append(line + end_str)
-                            line = ''  # No new line
-                            break
-                if line:  # it will be the last line, if var_names was not empty
-                    lines.append(line)
+                        if line_names:
+                            lines.append(', '.join(line_names))
+                        line_names = [name]
+                        lengths = len(name)
+                if line_names:  # it will be the last line, if var_names was not empty
+                    lines.append(', '.join(line_names))
                 if len(lines) > 1:
                     return lines
                 else:
@@ -1016,8 +1093,8 @@ class XDSMWriter(XDSM, BaseXDSMWriter):
         str
             Formatted var string.
         """
-        if superscripts is None:
-            superscripts = _SUPERSCRIPTS
+        if superscripts is None:  # Default superscripts are preformatted
+            return name + _TEX_SUPERSCRIPT_STRS[var_type]
         sup = superscripts[var_type]
         return '{}^{{{}}}'.format(name, sup)
 
@@ -1108,7 +1185,7 @@ def write_xdsm(data_source, filename, model_path=None, recurse=True,
                include_solver=False, subs=_CHAR_SUBS, show_browser=True,
                add_process_conns=True, show_parallel=True, quiet=False, output_side=_DEFAULT_OUTPUT_SIDE,
                legend=False, class_names=True, equations=False, include_indepvarcomps=True,
-               writer_options={}, **kwargs):
+               writer_options=None, **kwargs):
     """
     Write XDSM diagram of an optimization problem.
 
@@ -1203,8 +1280,10 @@ def write_xdsm(data_source, filename, model_path=None, recurse=True,
     include_indepvarcomps : bool, optional
         Include IndepVarComps as system but only as external inputs. If turned off, the XDSM is simpler.
         Defaults to True.
-    writer_options : dict, optional
+    writer_options : dict or None, optional
         Options passed to the writer class at initialization.
+        With XDSMjs {"dedupe_edges": True} merges the connections between the same blocks into one
+        edge.
     **kwargs : dict
         Keyword arguments
 
@@ -1212,17 +1291,20 @@ def write_xdsm(data_source, filename, model_path=None, recurse=True,
     -------
        XDSM or AbstractXDSMWriter
     """
+    # Imported here, the OpenMDAO API is needed only when a diagram is written
+    from openmdao.api import Problem
+
     build_pdf = False
     writer = kwargs.pop('writer', None)
 
     if out_format in ('tex', 'pdf') and (writer is None):
         if out_format == 'pdf':
-            if not find_executable('pdflatex'):
+            if not _pdflatex_available():
                 print("Can't find pdflatex, so a pdf can't be generated.")
             else:
                 build_pdf = True
 
-    viewer_data = _get_viewer_data(data_source)
+    viewer_data = _load_viewer_data(data_source)
 
     driver = viewer_data.get('driver', None)
     if driver:
@@ -1287,13 +1369,74 @@ def write_xdsm(data_source, filename, model_path=None, recurse=True,
                        include_indepvarcomps=include_indepvarcomps, **kwargs)
 
 
+def _load_viewer_data(data_source):
+    """
+    Get the model data for the XDSM from a Problem or a case recorder file.
+
+    The data of a case recorder file is cached based on the path, size and modification time of
+    the file, so writing several diagrams from the same file reads it only once. Each call returns
+    a copy of the cached data. The data of a Problem is always collected again, because the
+    problem can change between the diagrams.
+
+    Parameters
+    ----------
+    data_source : Problem or str
+        The Problem or case recorder database containing the model or model data.
+
+    Returns
+    -------
+        dict
+    """
+    if isinstance(data_source, str) and os.path.isfile(data_source):
+        stat = os.stat(data_source)
+        viewer_data = _load_recorded_viewer_data(os.path.abspath(data_source), stat.st_size, stat.st_mtime_ns)
+        # Every caller gets its own copy, so changing the returned data does not change the cache
+        return copy.deepcopy(viewer_data)
+    from openmdao.visualization.n2_viewer.n2_viewer import _get_viewer_data
+    return _get_viewer_data(data_source)
+
+
+@lru_cache(maxsize=8)
+def _load_recorded_viewer_data(path, size, mtime):
+    # Reads the model data from a case recorder file. The size and modification time are only part
+    # of the cache key, so a changed file is read again.
+    from openmdao.visualization.n2_viewer.n2_viewer import _get_viewer_data
+    return _get_viewer_data(path)
+
+
+def clear_viewer_data_cache():
+    """
+    Clear the cached model data of the case recorder files.
+    """
+    _load_recorded_viewer_data.cache_clear()
+
+
+def clear_formatting_caches():
+    """
+    Clear the cached name conversions and label formatting.
+
+    The caches are bounded, clearing them only releases memory, e.g. after writing many diagrams
+    in a loop.
+    """
+    _textify.cache_clear()
+    _convert_abs_name.cache_clear()
+    _translate_illegal_chars.cache_clear()
+    _compile_substitutes.cache_clear()
+
+
+@lru_cache(maxsize=1)
+def _pdflatex_available():
+    # Looks up pdflatex on the PATH only once per session, the search stats every directory.
+    return which('pdflatex') is not None
+
+
 def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanup=True,
                 design_vars=None, responses=None, residuals=None, model_path=None, recurse=True,
                 include_external_outputs=True, subs=_CHAR_SUBS, writer='pyXDSM', show_browser=False,
                 add_process_conns=True, show_parallel=True, quiet=False, build_pdf=False,
                 output_side=_DEFAULT_OUTPUT_SIDE, driver_type='optimization', legend=False,
                 class_names=False, equations=False, include_indepvarcomps=True,
-                writer_options={}, **kwargs):
+                writer_options=None, **kwargs):
     """
     XDSM writer. Components are extracted from the connections of the problem.
 
@@ -1359,7 +1502,7 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
     include_indepvarcomps : bool, optional
         Include IndepVarComps as system but only as external inputs. If turned off, the XDSM is simpler.
         Defaults to True.
-    writer_options : dict, optional
+    writer_options : dict or None, optional
         Options passed to the writer class at initialization.
     **kwargs : dict
         Keyword arguments, includes writer specific options.
@@ -1398,9 +1541,14 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
     else:
         raise TypeError(error_msg.format(writer))
 
+    replaced_names = {}  # The same names recur in many blocks, so they are replaced only once
+
     def replace_chars(name):
         # A shorthand for the functions, since within this scope the same always substitutes are used.
-        return _replace_chars(name, substitutes=subs)
+        replaced = replaced_names.get(name)
+        if replaced is None:
+            replaced = replaced_names[name] = _replace_chars(name, substitutes=subs)
+        return replaced
 
     def format_block(names, **kwargs):
         # Sets the width, number of lines and other string formatting for a block.
@@ -1438,7 +1586,8 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
         top_level_solver = dict(tree)
         top_level_solver.update({'comps': list(comps), 'abs_name': 'root@solver', 'index': 0, 'type': 'solver'})
         comps.insert(0, top_level_solver)  # Add top level solver
-    comps_dct = {comp['abs_name']: comp for comp in comps if comp['type'] != 'solver'}
+    # Names of the parallel components (solvers are never stacked)
+    parallel_comps = {comp['abs_name'] for comp in comps if comp['type'] != 'solver' and comp['is_parallel']}
 
     solvers = []  # Solver labels
 
@@ -1448,26 +1597,29 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
     external_outputs2 = _process_connections(external_outputs1, recurse=recurse, subs=subs)
 
     if not include_indepvarcomps:  # Reconnect connections
-        filtered_comp_names = [c['name'] for c in filtered_comps]
+        filtered_comp_names = {c['name'] for c in filtered_comps}
+        filtered_comp_names.add(_AUTO_IVC_NAME)
 
-        for src, tgts in conns2.copy().items():
-            if src in filtered_comp_names or (src == _AUTO_IVC_NAME):
+        conns_kept = {}  # Connections, which are not from the filtered components
+        for src, tgts in conns2.items():
+            if src in filtered_comp_names:
                 if src in design_vars2:
                     for tgt in tgts:
                         dv_tgt = design_vars2.setdefault(tgt, [])
                         dv_tgt += design_vars2[src]
                     del design_vars2[src]
                 else:  # Make external input from it
-                    for tgt in tgts:
-                        var_names = conns2[src][tgt]
+                    for tgt, var_names in tgts.items():
                         var_names = [x.format_var_str(var, 'initial0') for var in var_names]  # make them initial vals
                         external_inputs2.setdefault(tgt, {}).setdefault(tgt, []).extend(var_names)
-                del conns2[src]
+            else:
+                conns_kept[src] = tgts
+        conns2 = conns_kept
 
     def add_solver(solver_dct):
         # Adds a solver. Uses some vars from the outer scope.
         # Returns True, if it is a non-default linear or nonlinear solver
-        comp_names = [_replace_illegal_chars(c['abs_name']) for c in solver_dct['comps']]
+        comp_names = {_replace_illegal_chars(c['abs_name']) for c in solver_dct['comps']}
         solver_label = _format_solver_str(solver_dct, stacking=box_stacking)
 
         if isinstance(solver_label, str):
@@ -1483,9 +1635,11 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
 
             # Add the connections
             for src, dct in conns2.items():
+                if src not in comp_names:  # Only connections between the components of the solver
+                    continue
                 for tgt, conn_vars in dct.items():
-                    formatted_conns = format_block(conn_vars)
-                    if (src in comp_names) and (tgt in comp_names):
+                    if tgt in comp_names:
+                        formatted_conns = format_block(conn_vars)
                         formatted_targets = format_block([x.format_var_str(c, 'target') for c in conn_vars])
                         # From solver to components (targets)
                         x.connect(solver_name, tgt, formatted_targets)
@@ -1500,31 +1654,41 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
         driver_name = _replace_illegal_chars(driver)
         x.add_driver(name=driver_name, label=driver_label, driver_type=driver_type.lower())
 
+        format_var_str = x.format_var_str
+        # The sides of the optimal outputs are the same for all variables
+        comp_output_side = get_output_side('default')
+        driver_output_side = get_output_side(driver_type)
+
         # Design variables
-        for comp, conn_vars in design_vars2.items():
-            # Format var names
-            conn_vars = [replace_chars(var) for var in conn_vars]
-            # Optimal var names
-            opt_con_vars = [x.format_var_str(var, 'optimal') for var in conn_vars]
-            # Initial var names
-            init_con_vars = [x.format_var_str(var, 'initial') for var in conn_vars]
+        for comp, dv_names in design_vars2.items():
+            conn_vars = []  # Formatted var names
+            opt_con_vars = []  # Optimal var names
+            init_con_vars = []  # Initial var names
+            for var in dv_names:  # All three are made in one pass
+                var = replace_chars(var)
+                conn_vars.append(var)
+                opt_con_vars.append(format_var_str(var, 'optimal'))
+                init_con_vars.append(format_var_str(var, 'initial'))
             # Connection from optimizer
             x.connect(driver_name, comp, label=format_block(conn_vars))
             # Optimal design variables
-            x.add_output(comp, label=format_block(opt_con_vars), side=get_output_side('default'))
-            x.add_output(driver_name, label=format_block(opt_con_vars), side=get_output_side(driver_type))
+            x.add_output(comp, label=format_block(opt_con_vars), side=comp_output_side)
+            x.add_output(driver_name, label=format_block(opt_con_vars), side=driver_output_side)
             # Initial design variables
             x.add_input(driver_name, label=format_block(init_con_vars))
 
         # Responses
-        for comp, conn_vars in responses2.items():
-            # Optimal var names
-            conn_vars = [replace_chars(var) for var in conn_vars]
-            opt_con_vars = [x.format_var_str(var, 'optimal') for var in conn_vars]
+        for comp, resp_names in responses2.items():
+            conn_vars = []  # Formatted var names
+            opt_con_vars = []  # Optimal var names
+            for var in resp_names:
+                var = replace_chars(var)
+                conn_vars.append(var)
+                opt_con_vars.append(format_var_str(var, 'optimal'))
             # Connection to optimizer
             x.connect(comp, driver_name, conn_vars)
             # Optimal output
-            x.add_output(comp, format_block(opt_con_vars), side=get_output_side('default'))
+            x.add_output(comp, format_block(opt_con_vars), side=comp_output_side)
 
     # Add components
     solver_dcts = []
@@ -1546,39 +1710,36 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
             if src and tgt:
                 if src == _AUTO_IVC_NAME:
                     has_auto_ivc = True
-                # Because Auto-IVC not in comps, it has to be skipped
-                src_parallel = comps_dct[src]['is_parallel'] if src in comps_dct else False
-                stack = show_parallel and (src_parallel or comps_dct[tgt]['is_parallel'])
+                # Auto-IVC is not in comps, so it is never parallel
+                stack = show_parallel and (src in parallel_comps or tgt in parallel_comps)
                 x.connect(src, tgt, label=format_block(conn_vars), stack=stack)
             else:  # Source or target missing
                 msg = 'Connection "{conn}" from "{src}" to "{tgt}" ignored.'
                 simple_warning(msg.format(src=src, tgt=tgt, conn=conn_vars))
 
     if has_auto_ivc:
-        auto_ivc_comp = OrderedDict(name=_AUTO_IVC_NAME, stack=False, type="subsystem", expressions=None,
-                                    is_parallel=False, component_type=None, subsystem_type='component')
-        auto_ivc_comp["class"] = "IndepVarComp"
-        auto_ivc_comp["abs_name"] = auto_ivc_comp["name"]
+        auto_ivc_comp = {'name': _AUTO_IVC_NAME, 'stack': False, 'type': 'subsystem', 'expressions': None,
+                         'is_parallel': False, 'component_type': None, 'subsystem_type': 'component',
+                         'class': 'IndepVarComp', 'abs_name': _AUTO_IVC_NAME}
         if include_indepvarcomps:
             comps.insert(0, auto_ivc_comp)  # Auto-IVC added as the first component
         else:
             filtered_comps.insert(0, auto_ivc_comp)  # Auto-IVC added as the first filtered component (not on the XDSM)
 
     for comp in comps:  # Driver is 1, so starting from 2
+        if include_solver and comp['type'] == 'solver':  # solver
+            if add_solver(comp):  # Return value is true, if solver is not the default
+                # If not default solver, add to the solver dictionary
+                solver_dcts.append(comp)
+            continue
+        # component or group
         # The second condition is for backwards compatibility with older data.
         if equations and comp.get('expressions', None) is not None:
             # One of the $ signs has to be removed to correctly parse it
             if isinstance(x, XDSMWriter):
-                def parse(expr):
-                    # TODO add curly brackets to support multiple digit index
-                    for (ch, rep) in (('$$', '$'), (r'[', '_'), (r']', '')):  # brackets converted to lower index
-                        expr = expr.replace(ch, rep)
-                    # One of the $ signs has to be removed to correctly parse it
-                    return py2tex(expr).replace('$$', '$')
-
                 expression = comp['expressions']
                 try:
-                    label = ', '.join(map(parse, expression))
+                    label = ', '.join([_expression_to_tex(expr, py2tex) for expr in expression])
                 except TypeError:
                     label = replace_chars(comp['name'])
                     simple_warning('Could not parse "{}"'.format(expression))
@@ -1590,17 +1751,12 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
         else:
             label = replace_chars(comp['name'])
         stack = show_parallel and comp['is_parallel']
-        if include_solver and comp['type'] == 'solver':  # solver
-            if add_solver(comp):  # Return value is true, if solver is not the default
-                # If not default solver, add to the solver dictionary
-                solver_dcts.append(comp)
-        else:  # component or group
-            cls_name = comp.get('class', None) if class_names else None
-            comp_type = comp['component_type']
-            if comp.get('subsystem_type', None) == 'group':
-                comp_type = 'group'
-            x.add_comp(name=comp['abs_name'], label=label, stack=stack,
-                       comp_type=comp_type, cls=cls_name)
+        cls_name = comp.get('class', None) if class_names else None
+        comp_type = comp['component_type']
+        if comp.get('subsystem_type', None) == 'group':
+            comp_type = 'group'
+        x.add_comp(name=comp['abs_name'], label=label, stack=stack,
+                   comp_type=comp_type, cls=cls_name)
 
     # Add process connections
     if add_process_conns:
@@ -1612,9 +1768,9 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
     # Add the externally sourced inputs
     for src, tgts in external_inputs2.items():
         for tgt, conn_vars in tgts.items():
-            formatted_conn_vars = map(replace_chars, conn_vars)
+            formatted_conn_vars = [replace_chars(var) for var in conn_vars]
             if tgt:
-                stack = show_parallel and comps_dct[tgt]['is_parallel']
+                stack = show_parallel and tgt in parallel_comps
                 x.add_input(tgt, format_block(formatted_conn_vars), stack=stack)
             else:  # Target missing
                 msg = 'External input to "{tgt}" ignored.'
@@ -1623,12 +1779,11 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
     # Add the externally connected outputs
     if include_external_outputs:
         for src, tgts in external_outputs2.items():
-            output_vars = set()
-            for tgt, conn_vars in tgts.items():
-                output_vars |= set(conn_vars)
-            formatted_outputs = map(replace_chars, output_vars)
+            # Variables connected to any target, without duplicates and in the order of the connections
+            output_vars = list(dict.fromkeys(var for conn_vars in tgts.values() for var in conn_vars))
+            formatted_outputs = [replace_chars(var) for var in output_vars]
             if src:
-                stack = show_parallel and comps_dct[src]['is_parallel']
+                stack = show_parallel and src in parallel_comps
                 x.add_output(src, formatted_outputs, side='right', stack=stack)
             else:  # Source or target missing
                 msg = 'External output "{conn}" from "{src}" ignored.'
@@ -1641,7 +1796,6 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
         # provided for showing the results.
         import webbrowser
         import sys
-        import os
         ext = x.extension
         if not isinstance(ext, str):
             err_msg = '"{}" is an invalid extension.'
@@ -1655,6 +1809,14 @@ def _write_xdsm(filename, viewer_data, driver=None, include_solver=False, cleanu
     return x  # Returns the writer instance
 
 
+def _expression_to_tex(expr, py2tex):
+    # Converts an ExecComp expression to LaTeX with the py2tex function of pytexit.
+    # TODO add curly brackets to support multiple digit index
+    expr = expr.replace('$$', '$').translate(_INDEX_BRACKETS)  # brackets converted to lower index
+    # One of the $ signs has to be removed to correctly parse it
+    return py2tex(expr).replace('$$', '$')
+
+
 def _residual_str(name):
     """Make a residual symbol."""
     return '\\mathcal{R}(%s)' % name
@@ -1682,7 +1844,8 @@ def _process_connections(conns, recurse=True, subs=None):
     def convert(x):
         return _convert_name(x, recurse=recurse, subs=subs)
 
-    conns_new = [{k: convert(v) for k, v in conn.items() if k in ('src', 'tgt')} for conn in conns]
+    # The converted connections are consumed one by one, without making a list of them
+    conns_new = ({'src': convert(conn['src']), 'tgt': convert(conn['tgt'])} for conn in conns)
     return _accumulate_connections(conns_new, connection_namer=_CONNECTION_NAMING)
 
 
@@ -1699,7 +1862,7 @@ def _accumulate_connections(conns, connection_namer='mixed'):
 
     Parameters
     ----------
-    conns : list
+    conns : iterable
         Connections.
     connection_namer : str, optional
         Defaults to "mixed", where in case of Auto-IVC the target names are used, otherwise the source names.
@@ -1711,7 +1874,8 @@ def _accumulate_connections(conns, connection_namer='mixed'):
     """
     name_type = 'path'
     conns_new = dict()
-    for conn in conns:  # list
+    added = set()  # (source, target, variable) triplets already added
+    for conn in conns:  # iterable
         src_comp = conn['src'][name_type]
         tgt_comp = conn['tgt'][name_type]
         if src_comp == tgt_comp:
@@ -1725,9 +1889,11 @@ def _accumulate_connections(conns, connection_namer='mixed'):
             var = conn[namer]['var']
         else:
             var = conn[connection_namer]['var']
-        conns_new.setdefault(src_comp, {})
-        if var not in conns_new[src_comp].setdefault(tgt_comp, []):  # Avoid duplicates
-            conns_new[src_comp][tgt_comp].append(var)
+        conn_vars = conns_new.setdefault(src_comp, {}).setdefault(tgt_comp, [])
+        key = src_comp, tgt_comp, var
+        if key not in added:  # Avoid duplicates, the lists keep the order of the connections
+            added.add(key)
+            conn_vars.append(var)
     return conns_new
 
 
@@ -1752,40 +1918,44 @@ def _collect_connections(variables, recurse, model_path=None, connections=None,
         dict(str, list)
     """
 
-    conv_vars = [_convert_name(v, recurse) for v in variables]
-    if connection_namer != 'src':
-        tgt_vars = {_convert_name(c['src'], recurse)['abs_name']: _convert_name(c['tgt'], recurse) for c in connections if c['src'] in variables}
-    connections = dict()  # Initialize
-    for conv_var in conv_vars:
-        path = _make_rel_path(conv_var['path'], model_path=model_path)
-        if connection_namer == 'src':
-            var_name = conv_var['var']
-        elif connection_namer == 'tgt':
-            var_name = tgt_vars[conv_var['abs_name']]['var']
-        elif connection_namer == 'mixed':
-            if conv_var['comp'].replace('_', '@') == _AUTO_IVC_NAME:
-                var_name = tgt_vars[conv_var['abs_name']]['var']
-            else:
-                var_name = conv_var['var']
-        else:
-            raise ValueError(f'Invalid connection namer "{connection_namer}", choose from "src", "tgt" or "mixed"')
-        connections.setdefault(path, []).append(var_name)
-    return connections
+    if connection_namer not in ('src', 'tgt', 'mixed'):
+        raise ValueError(f'Invalid connection namer "{connection_namer}", choose from "src", "tgt" or "mixed"')
+
+    # The (comp, var, abs_name, path) tuples of the converted names are read directly from the cache,
+    # without building a dict for each variable.
+    conv_vars = {v: _convert_abs_name(v, recurse, None) for v in variables}
+    # Variables, which are named after their targets. The naming is decided once, not in the loop.
+    if connection_namer == 'tgt':
+        tgt_named = conv_vars
+    elif connection_namer == 'mixed':  # Only the Auto-IVC outputs
+        tgt_named = {v for v, (comp, _, _, _) in conv_vars.items() if comp == _AUTO_IVC_COMP}
+    else:
+        tgt_named = ()
+    # Target variable names by the unconverted source names, only for the variables named after them
+    tgt_vars = {c['src']: _convert_abs_name(c['tgt'], recurse, None)[1] for c in connections
+                if c['src'] in tgt_named} if tgt_named else {}
+    connections = defaultdict(list)  # Initialize
+    for name, (_, var_name, _, path) in conv_vars.items():
+        if name in tgt_named:
+            var_name = tgt_vars[name]
+        connections[_make_rel_path(path, model_path=model_path)].append(var_name)
+    return dict(connections)
 
 
 def _get_path(name, sep='.'):
     # Returns path until the last separator in the name
-    return name.rsplit(sep, 1)[0]
+    i = name.rfind(sep)
+    return name if i < 0 else name[:i]
 
 
 def _make_rel_path(full_path, model_path, sep='.'):
     # Path will be cut from this character. Length of model path + separator after it.
     # If path does not contain the model path, the full path will be returned.
     if model_path is not None:
-        path = model_path + sep  # Add separator character
-        first_char = len(path)
-        if full_path.startswith(path):
-            return full_path[first_char:]
+        n = len(model_path)
+        # Checks the model path and the separator after it without building the prefix string
+        if full_path.startswith(model_path) and full_path.startswith(sep, n):
+            return full_path[n + len(sep):]
     return full_path  # No model path, so return the original
 
 
@@ -1806,43 +1976,62 @@ def _convert_name(name, recurse=True, subs=None):
 
     Returns
     -------
-        dict(str, str)
+        dict(str, str) or list(dict(str, str))
     """
     def convert(abs_name):
-        sep = '.'
-        abs_name = abs_name.replace('@', sep)
-        name_items = abs_name.split(sep)
-        if recurse:
-            if len(name_items) > 1:
-                comp = name_items[-2]  # -1 is variable name, before that -2 is the component name
-                path = _get_path(abs_name, sep=sep)
-            else:
-                msg = ('The name "{}" cannot be processed. The separator character is "{}", '
-                       'which does not occur in the name.')
-                raise ValueError(msg.format(abs_name, sep))
-        else:
-            comp = name_items[0]
-            path = comp
-        var = name_items[-1]
-        var = _replace_chars(var, substitutes=subs)
-        return {'comp': comp, 'var': var,
-                'abs_name': _replace_illegal_chars(abs_name), 'path': _replace_illegal_chars(path)}
+        try:
+            converted = _convert_abs_name(abs_name, recurse, subs)
+        except TypeError:  # Unhashable substitutes, convert without caching
+            converted = _convert_abs_name.__wrapped__(abs_name, recurse, subs)
+        return dict(zip(('comp', 'var', 'abs_name', 'path'), converted))
 
     if isinstance(name, list):  # If a source has multiple targets
-        return map(convert, name)
+        return [convert(n) for n in name]
     else:  # string
         return convert(name)
 
 
-def _replace_illegal_chars(name, illegal_cars=('.', ' ', '-', '_', ':')):
+@lru_cache(maxsize=8192)
+def _convert_abs_name(abs_name, recurse, subs):
+    # Converts one absolute name for _convert_name. The same endpoints occur in many connections,
+    # so the results are cached. Returns a tuple of (comp, var, abs_name, path).
+    sep = '.'
+    abs_name = abs_name.replace('@', sep)
+    name_items = abs_name.split(sep)
+    if recurse:
+        if len(name_items) > 1:
+            comp = name_items[-2]  # -1 is variable name, before that -2 is the component name
+            path = _get_path(abs_name, sep=sep)
+        else:
+            msg = ('The name "{}" cannot be processed. The separator character is "{}", '
+                   'which does not occur in the name.')
+            raise ValueError(msg.format(abs_name, sep))
+    else:
+        comp = name_items[0]
+        path = comp
+    var = name_items[-1]
+    var = _replace_chars(var, substitutes=subs)
+    return comp, var, _replace_illegal_chars(abs_name), _replace_illegal_chars(path)
+
+
+def _replace_illegal_chars(name, illegal_cars=_ILLEGAL_CHARS):
     # Replaces illegal characters in names for pyXDSM component and connection names
     # This does not effect the labels, only reference names in TikZ
     if isinstance(name, str):
+        if illegal_cars is _ILLEGAL_CHARS:  # Single pass with the prebuilt table
+            return _translate_illegal_chars(name)
         for char in illegal_cars:
             name = name.replace(char, '@')
     return name
 
 
+@lru_cache(maxsize=4096)
+def _translate_illegal_chars(name):
+    # Replaces the default illegal characters in a name.
+    # The same names are converted repeatedly (components, solvers, connections), so it is cached.
+    return name.translate(_ILLEGAL_CHARS_TABLE)
+
+
 def _prune_connections(conns, model_path=None, sep='.'):
     """
     Remove connections that don't involve components within model.
@@ -1879,19 +2068,26 @@ def _prune_connections(conns, model_path=None, sep='.'):
         internal_conns = []
 
         path = model_path + sep  # Add separator character
+        n = len(path)
         for conn in conns:
             src = conn['src']
-            src_path = _make_rel_path(src, model_path=model_path)
             tgt = conn['tgt']
-            tgt_path = _make_rel_path(tgt, model_path=model_path)
-            conn_dct = {'src': src_path, 'tgt': tgt_path}
-
-            if src.startswith(path):
-                if tgt.startswith(path):
+            src_inside = src.startswith(path)
+            tgt_inside = tgt.startswith(path)
+            if not (src_inside or tgt_inside):
+                continue  # Both ends are outside of the model path, the connection is not shown
+
+            # Relative paths within the model path, the paths outside of it are kept
+            # (same as _make_rel_path)
+            conn_dct = {'src': src[n:] if src_inside else src,
+                        'tgt': tgt[n:] if tgt_inside else tgt}
+
+            if src_inside:
+                if tgt_inside:
                     internal_conns.append(conn_dct)  # Internal connections
                 else:
                     external_outputs.append(conn_dct)  # Externally connected output
-            elif tgt.startswith(path):
+            else:
                 external_inputs.append(conn_dct)  # Externally connected input
         return internal_conns, external_inputs, external_outputs
 
@@ -1927,90 +2123,96 @@ def _get_comps(tree, model_path=None, recurse=True, include_solver=False, includ
     """
     # Components are ordered in the tree, so they can be collected by walking through the tree.
     components = list()  # Components will be collected to this list
-    comp_names = set()  # To check if names are unique
+    comps_filtered = []  # IndepVarComps, which are not included, are collected to this list
+    filter_indeps = not include_indepvarcomps
+    comp_names = {}  # Components by name, to check if names are unique
     sep = '.'
 
-    def get_children(tree_branch, path=''):
-        local_comps = []
-
-        for ch in tree_branch['children']:
-            ch['path'] = path
-            name = ch['name']
-            if path:
-                ch['abs_name'] = _replace_illegal_chars(sep.join([path, name]))
-            else:
-                ch['abs_name'] = _replace_illegal_chars(name)
-            ch['rel_name'] = name
-            if ch['subsystem_type'] == 'component':
-                if name in comp_names:  # There is already a component with the same name
-                    ch['name'] = sep.join([path, name])  # Replace with absolute name
-                    for comp in components:
+    def get_children(top_branch):
+        # The tree is walked with an explicit stack of frames instead of recursive calls.
+        # A frame holds the iterator of the children of a branch, the path of the branch,
+        # the local components of the branch and the solver of the branch (or None).
+        stack = [[iter(top_branch['children']), '', [], None]]
+        # Bound to local names, because they are used for every node of the tree
+        join = sep.join
+        replace_illegal_chars = _replace_illegal_chars
+
+        while stack:
+            frame = stack[-1]
+            path = frame[1]
+
+            for ch in frame[0]:
+                name = ch['name']
+                abs_name = replace_illegal_chars(join([path, name]) if path else name)
+                if ch['subsystem_type'] == 'component':
+                    # The records are copies, the nodes of the (possibly cached) tree are not changed
+                    record = dict(ch, path=path, abs_name=abs_name, rel_name=name)
+                    if name in comp_names:  # There is already a component with the same name
+                        record['name'] = join([path, name])  # Replace with absolute name
+                        comp = comp_names[name]
                         if comp['name'] == name:  # replace in the other component to abs. name
-                            comp['name'] = sep.join([comp['path'], name])
-                components.append(ch)
-                comp_names.add(ch['rel_name'])
-                local_comps.append(ch)
-            else:  # Group
-                # Add a solver to the component list, if this group has a linear or nonlinear
-                # solver.
-                has_solver = False
-                if include_solver:
-                    solver_names = []
-                    solver_dct = {}
-                    for solver_typ, default_solver in _DEFAULT_SOLVER_NAMES.items():
-                        k = '{}_solver'.format(solver_typ)
-                        if ch[k] != default_solver:
-                            solver_names.append(ch[k])
-                            has_solver = True
-                        solver_dct[k] = ch[k]
-                    if has_solver:
-                        i_solver = len(components)
-                        name_str = ch['abs_name'] + '@solver'
-                        # "comps" will be filled later
-                        solver = {'abs_name': _replace_illegal_chars(name_str), 'rel_name': solver_names,
-                                  'type': 'solver', 'name': name_str, 'is_parallel': False,
-                                  'component_type': 'MDA', 'index': i_solver}
-                        solver.update(solver_dct)
-                        components.append(solver)
-                        comp_names.add(name_str)
-                # Add the group or components in the group
-                if recurse:  # it is not a component and recurse is True
-                    if path:
-                        new_path = sep.join([path, ch['name']])
+                            comp['name'] = join([comp['path'], name])
+                    if filter_indeps and ch['component_type'] == 'indep':  # Filter out IndepVarComps
+                        comps_filtered.append(record)
                     else:
-                        new_path = ch['name']
-                    local_comps = get_children(ch, new_path)
-                else:
-                    components.append(ch)
-                    comp_names.add(ch['rel_name'])
-                    local_comps = [ch]
-                # Add to the solver, which components are in its loop.
-                if include_solver and has_solver:
-                    components[i_solver]['comps'] = local_comps
-                    local_comps = []
-        return list(local_comps)
+                        components.append(record)
+                    comp_names[name] = record
+                    frame[2].append(record)
+                else:  # Group
+                    # Add a solver to the component list, if this group has a linear or nonlinear
+                    # solver.
+                    solver = None
+                    if include_solver:
+                        solver_names = [ch[k] for k, default_solver in _SOLVER_KEY_DEFAULTS
+                                        if ch[k] != default_solver]
+                        if solver_names:  # Not only default solvers
+                            name_str = abs_name + '@solver'
+                            # "comps" will be filled later
+                            solver = {'abs_name': replace_illegal_chars(name_str), 'rel_name': solver_names,
+                                      'type': 'solver', 'name': name_str, 'is_parallel': False,
+                                      'component_type': 'MDA',
+                                      'index': len(components) + len(comps_filtered)}
+                            for k, _ in _SOLVER_KEY_DEFAULTS:
+                                solver[k] = ch[k]
+                            components.append(solver)
+                            comp_names[name_str] = solver
+                    # Add the group or components in the group
+                    if recurse:  # it is not a component and recurse is True
+                        new_path = join([path, name]) if path else name
+                        # Continue with the children of the group, then return to this branch
+                        stack.append([iter(ch['children']), new_path, [], solver])
+                        break
+                    else:
+                        record = dict(ch, path=path, abs_name=abs_name, rel_name=name)
+                        if filter_indeps and ch['component_type'] == 'indep':  # Filter out IndepVarComps
+                            comps_filtered.append(record)
+                        else:
+                            components.append(record)
+                        comp_names[name] = record
+                        frame[2] = [record]
+                        # Add to the solver, which components are in its loop.
+                        if solver is not None:
+                            solver['comps'] = frame[2]
+                            frame[2] = []
+            else:  # All children of the branch were added
+                stack.pop()
+                if stack:  # The local components of the group replace those of the parent branch
+                    local_comps = list(frame[2])
+                    # Add to the solver, which components are in its loop.
+                    if frame[3] is not None:
+                        frame[3]['comps'] = local_comps
+                        local_comps = []
+                    stack[-1][2] = local_comps
 
     top_level_tree = tree
     if model_path is not None:
-        path_list = model_path.split(sep)
-        while path_list:
-            next_path = path_list.pop(0)
-            children = [child for child in top_level_tree['children']]
-            top_level_tree = [c for c in children if c['name'] == next_path][0]
+        # The model path was already validated, every system in it exists in the tree
+        for next_path in model_path.split(sep):
+            top_level_tree = next(c for c in top_level_tree['children'] if c['name'] == next_path)
 
     get_children(top_level_tree)
 
-    comps_filtered = []
-    if not include_indepvarcomps:  # Filter out IndepVarComps
-        comps_out = []
-        for c in components:
-            if c['component_type'] != 'indep':
-                comps_out.append(c)
-            else:
-                comps_filtered.append(c)
-        return comps_out, comps_filtered
-    else:
-        return components, comps_filtered
+    return components, comps_filtered
 
 
 def _replace_chars(name, substitutes):
@@ -2037,11 +2239,52 @@ def _replace_chars(name, substitutes):
        str
     """
     if substitutes:
-        for k, v in substitutes:
-            name = name.replace(k, v)
+        try:
+            steps = _compile_substitutes(substitutes)
+        except TypeError:  # Unhashable substitutes (e.g. list of lists) are compiled without caching
+            steps = _compile_substitutes.__wrapped__(substitutes)
+        for step in steps:
+            if isinstance(step, dict):
+                name = name.translate(step)
+            else:
+                name = name.replace(*step)
     return name
 
 
+@lru_cache(maxsize=32)
+def _compile_substitutes(substitutes):
+    """
+    Compile character substitutes into a sequence of replacement steps.
+
+    Consecutive single character substitutes are merged into one translation table, so they are
+    applied with a single pass over the string. A substitute is only merged, if the result is the
+    same as replacing the characters one after the other, i.e. the character does not occur in
+    a replacement string already in the table. Other substitutes are kept as (old, new) pairs.
+
+    Parameters
+    ----------
+    substitutes: tuple
+        Character pairs with old and substitute characters
+
+    Returns
+    -------
+       list(dict or tuple(str, str))
+    """
+    steps = []
+    table = None
+    for k, v in substitutes:
+        if len(k) == 1:
+            if table is None or k in table or any(k in rep for rep in table.values()):
+                table = {k: v}
+                steps.append(table)
+            else:
+                table[k] = v
+        else:
+            table = None
+            steps.append((k, v))
+    return [str.maketrans(step) if isinstance(step, dict) else step for step in steps]
+
+
 def _format_solver_str(dct, stacking='horizontal', solver_types=('nonlinear', 'linear')):
     """
     Format solver string.
@@ -2063,7 +2306,7 @@ def _format_solver_str(dct, stacking='horizontal', solver_types=('nonlinear', 'l
 
     solvers = []
     for solver_type in solver_types:  # loop through all solver types
-        solver_name = dct['{}_solver'.format(solver_type)]
+        solver_name = dct[_SOLVER_KEYS[solver_type]]
         if solver_name != _DEFAULT_SOLVER_NAMES[solver_type]:  # Not default solver found
             solvers.append(solver_name)
     if stacking == 'vertical':
@@ -2100,6 +2343,35 @@ def _multiline_block(*texts, **kwargs):
     return out_txts
 
 
+def _merge_labels(label1, label2):
+    """
+    Merge the labels of two connections between the same blocks.
+
+    Lists are merged without repeating the items, strings are joined with a comma.
+
+    Parameters
+    ----------
+    label1 : str or list(str)
+        Label of the existing connection.
+    label2 : str or list(str)
+        Label of the new connection.
+
+    Returns
+    -------
+       list(str) or str
+    """
+    if isinstance(label1, str) and isinstance(label2, str):
+        if label1 == label2:
+            return label1
+        return ', '.join([label1, label2])
+    labels = [label1] if isinstance(label1, str) else list(label1)
+    for label in ([label2] if isinstance(label2, str) else label2):
+        if label not in labels:
+            labels.append(label)
+    return labels
+
+
+@lru_cache(maxsize=4096)
 def _textify(name):
     # Uses the LaTeX \text{} command to insert plain text in math mode
     return r'\text{{{}}}'.format(name)
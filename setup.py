@@ -26,6 +26,13 @@ setup(
     extras_require={
         'tex': [
             'pytexit',
+        ],
+        'json': [
+            'orjson',
+        ],
+        'test': [
+            'pytest',
+            'pytest-xdist',
         ]
     },
     packages=[